@@ -2,20 +2,31 @@ import os
 import numpy as np
 from scipy.io import savemat
 from bandreader import *
+from profiling import stage
 
 # RAND_TYPE = ("Amplitude_VV", "Amplitude_VH")
 
-def run(fpath: str, spath: str, zname: str, ztime: int, size: int):
-    """将SAR数据转换为MATLAB矩阵"""
+def run(fpath: str, spath: str, zname: str, ztime: int, size: int,
+        bbox: tuple = None, geojson: str = None):
+    """将SAR数据转换为MATLAB矩阵
+
+    给定 bbox (min_lon, min_lat, max_lon, max_lat) 或 geojson 时，按 map info
+    只读取该地理范围内的像素，否则读取整景后取左上角 size x size
+    """
 
     dirs = [x for x in os.listdir(fpath) if x.endswith('.data')]
     # tmp = dirs[0][24:32]
     dirs.sort(key=lambda x: int(x[24:32]))
     mat_vv, mat_vh = [], []
     for d in dirs:
-        data_vv = Band(os.path.join(fpath, d), "Intensity_VV").radar_pixels
-        # print(data_vv.shape)
-        data_vh = Band(os.path.join(fpath, d), "Intensity_VH").radar_pixels
+        try:
+            data_vv = Band(os.path.join(fpath, d), "Intensity_VV", bbox, geojson).radar_pixels
+            # print(data_vv.shape)
+            data_vh = Band(os.path.join(fpath, d), "Intensity_VH", bbox, geojson).radar_pixels
+        except ValueError as e:
+            # bbox 超出该景的范围
+            print("WARN: skip '{}': {}".format(d.removesuffix(".data"), e))
+            continue
         # print(data_vh.shape)      
         data_slice_vv = data_vv[0:size, 0:size]
         data_slice_vh = data_vh[0:size, 0:size]
@@ -29,19 +40,25 @@ def run(fpath: str, spath: str, zname: str, ztime: int, size: int):
 
     if not os.path.exists(spath):
         os.makedirs(save_path)
-    ndarr_vv = np.array(mat_vv, dtype=np.float32)
+    with stage("float32 cast"):
+        ndarr_vv = np.array(mat_vv, dtype=np.float32)
     print(ndarr_vv.shape)
-    np.save(os.path.join(spath, f"{zname}_vv_{size}x{size}_t{ztime}.npy"), ndarr_vv)
+    with stage("np.save", bytes_written=ndarr_vv.nbytes):
+        np.save(os.path.join(spath, f"{zname}_vv_{size}x{size}_t{ztime}.npy"), ndarr_vv)
     ndarr_vv = ndarr_vv.swapaxes(1, 2).swapaxes(0, 2)
     print(ndarr_vv.shape)
-    savemat(os.path.join(spath, f"{zname}_vv_{size}x{size}_t{ztime}.mat"), {'data' : ndarr_vv})
+    with stage("savemat", bytes_written=ndarr_vv.nbytes):
+        savemat(os.path.join(spath, f"{zname}_vv_{size}x{size}_t{ztime}.mat"), {'data' : ndarr_vv})
 
-    ndarr_vh = np.array(mat_vh, dtype=np.float32)
+    with stage("float32 cast"):
+        ndarr_vh = np.array(mat_vh, dtype=np.float32)
     print(ndarr_vh.shape)
-    np.save(os.path.join(spath, f"{zname}_vh_{size}x{size}_t{ztime}.npy"), ndarr_vh)
+    with stage("np.save", bytes_written=ndarr_vh.nbytes):
+        np.save(os.path.join(spath, f"{zname}_vh_{size}x{size}_t{ztime}.npy"), ndarr_vh)
     ndarr_vh = ndarr_vh.swapaxes(1, 2).swapaxes(0, 2)
     print(ndarr_vh.shape)
-    savemat(os.path.join(spath, f"{zname}_vh_{size}x{size}_t{ztime}.mat"), {'data' : ndarr_vh})
+    with stage("savemat", bytes_written=ndarr_vh.nbytes):
+        savemat(os.path.join(spath, f"{zname}_vh_{size}x{size}_t{ztime}.mat"), {'data' : ndarr_vh})
 
 if __name__ == "__main__":
     file_path = "SanggendalaiLake/Lake1/subset_snap/t1006"
@@ -2,9 +2,11 @@ import os
 import numpy as np
 from PIL import Image
 from scipy.io import savemat
-from bandplot import *
+from profiling import stage
 
 def test():
+    from bandplot import BandFigure
+
     im = Image.open('data/s1a-iw-grd-vh-20210106t100617-20210106t100642-036016-043851-002.tif')
     data = np.array(im)
 
@@ -31,7 +33,9 @@ def main(file_path: str, zonename: str, size: int, save_path :str = None):
     imgs_vv = []
     imgs_vh = []
     for file in files:
-        data = np.array(Image.open(os.path.join(file_path, file)))
+        with stage("Image.open") as st:
+            data = np.array(Image.open(os.path.join(file_path, file)))
+            st.bytes_read = data.nbytes
         if data.sum() < 100:  # 图像中没有像素信息时应该丢弃图片
             continue
         if file.endswith('001.tif'):
@@ -51,17 +55,23 @@ def main(file_path: str, zonename: str, size: int, save_path :str = None):
             os.mkdir(spath)
         spath = os.path.join(spath, zonename)
 
-    imgs_vv = np.array(imgs_vv, dtype=np.float32)
+    with stage("float32 cast"):
+        imgs_vv = np.array(imgs_vv, dtype=np.float32)
     print(imgs_vv.shape)
-    np.save(spath + f'_vv_{size}x{size}.npy', imgs_vv)
+    with stage("np.save", bytes_written=imgs_vv.nbytes):
+        np.save(spath + f'_vv_{size}x{size}.npy', imgs_vv)
     imgs_vv = imgs_vv.swapaxes(1, 2).swapaxes(0, 2)
-    savemat(spath + f'_vv_{size}x{size}.mat', {'data': imgs_vv})
+    with stage("savemat", bytes_written=imgs_vv.nbytes):
+        savemat(spath + f'_vv_{size}x{size}.mat', {'data': imgs_vv})
 
-    imgs_vh = np.array(imgs_vh, dtype=np.float32)
+    with stage("float32 cast"):
+        imgs_vh = np.array(imgs_vh, dtype=np.float32)
     print(imgs_vh.shape)
-    np.save(spath + f'_vh_{size}x{size}.npy', imgs_vh)
+    with stage("np.save", bytes_written=imgs_vh.nbytes):
+        np.save(spath + f'_vh_{size}x{size}.npy', imgs_vh)
     imgs_vh = imgs_vh.swapaxes(1, 2).swapaxes(0, 2)
-    savemat(spath + f'_vh_{size}x{size}.mat', {'data': imgs_vh})
+    with stage("savemat", bytes_written=imgs_vh.nbytes):
+        savemat(spath + f'_vh_{size}x{size}.mat', {'data': imgs_vh})
 
 
 if __name__ == "__main__":
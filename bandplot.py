@@ -1,6 +1,19 @@
 import os
 import numpy as np
-import matplotlib.pyplot as plt
+from profiling import profiled
+
+
+class _LazyPyplot:
+    """
+    `matplotlib.pyplot`, imported on first use so that modules importing
+    `bandplot` don't pay for matplotlib unless a figure is requested
+    """
+    def __getattr__(self, name):
+        import matplotlib.pyplot as pyplot
+        return getattr(pyplot, name)
+
+
+plt = _LazyPyplot()
 
 
 class BandFigure:
@@ -16,8 +29,9 @@ class BandFigure:
         self.sigma     = 0
         self.dolog     = False
 
+    @profiled("BandFigure.plotall")
     def plotall(self, issave: bool=False, save_path: str=None,
-                dpi: int=300) -> plt.Figure:
+                dpi: int=300) -> "matplotlib.figure.Figure":
         """
         Parameters
         ------
@@ -61,8 +75,9 @@ class BandFigure:
             self._save("all", save_path, dpi)
         return fig
 
+    @profiled("BandFigure.plotfig")
     def plotfig(self, sigma: int=None, dolog: bool=False, issave: bool=False, 
-                save_path: str =None, dpi: int =300) -> plt.Figure:
+                save_path: str =None, dpi: int =300) -> "matplotlib.figure.Figure":
         """
         Plot only one Figure
 
@@ -186,6 +201,7 @@ class BandFigure:
         data[data >= r_limit] = 1
         return data
 
+    @profiled("BandFigure._save")
     def _save(self, fig_t: str, save_path: str, dpi=300) -> None:
         """Save figure to file"""
         figname = self.band_name
@@ -1,6 +1,8 @@
 import re
 import os
+import json
 import numpy as np
+from profiling import stage, profiled
 
 
 DATA_TYPES = {
@@ -13,10 +15,146 @@ DATA_TYPES = {
     "9": [16, "complex128"],
     "12": [2, "uint16"],
     "13": [4, "uint32"],
-    "14": [8, "uint64"],
+    "14": [8, "int64"],
     "15": [8, "uint64"]
  }
 
+# numpy dtype name -> ENVI data type
+ENVI_TYPES = {v[1]: k for k, v in DATA_TYPES.items()}
+
+# SLC 派生产品 -> SNAP 波段名前缀
+SLC_PRODUCTS = {
+    "intensity": "Intensity",
+    "amplitude": "Amplitude",
+    "phase": "Phase",
+    "db": "Intensity",
+}
+
+
+def parse_map_info(map_info: str) -> tuple:
+    """
+    ENVI `map info` string -> GDAL style geotransform
+
+    `map info = {Geographic Lat/Lon, 1.0, 1.0, 115.87, 42.55, 8.9e-05, 8.9e-05, WGS84, ...}`,
+    i.e. projection, reference pixel (x, y, 1-based), its map coordinates
+    (easting/lon, northing/lat) and pixel size (x, y).
+
+    Return
+    ------
+        (x0, dx, 0, y0, 0, -dy) : map coordinates of the upper left corner of
+        pixel (0, 0) and pixel size
+    """
+    fields = [f.strip() for f in map_info.split(',')]
+    ref_x, ref_y, east, north, dx, dy = map(float, fields[1:7])
+    x0 = east - (ref_x - 1) * dx
+    y0 = north + (ref_y - 1) * dy
+    return (x0, dx, 0.0, y0, 0.0, -dy)
+
+
+def format_map_info(map_info: str, geotransform: tuple) -> str:
+    """
+    ENVI `map info` string with its reference pixel moved to (1, 1) of
+    `geotransform`, the projection and datum fields of `map info` are kept
+    """
+    fields = [f.strip() for f in map_info.split(',')]
+    x0, dx, _, y0, _, dy = geotransform
+    fields[1:7] = ["1.0", "1.0", repr(x0), repr(y0), repr(dx), repr(-dy)]
+    return ", ".join(fields)
+
+
+def geojson_bbox(path: str) -> tuple:
+    """
+    Bounding box (min_lon, min_lat, max_lon, max_lat) of the first feature of
+    a geojson file, same footprint as used by `sentinel_crop`
+    """
+    with open(path, 'r') as fr:
+        footprint = json.load(fr)
+    coordinates = np.array(footprint["features"][0]["geometry"]["coordinates"][0])
+    mini = coordinates.min(axis=0)
+    maxi = coordinates.max(axis=0)
+    return (mini[0], mini[1], maxi[0], maxi[1])
+
+
+def _block_sum(data: np.ndarray, az: int, rg: int) -> np.ndarray:
+    """sum of every az x rg block of a C-contiguous array"""
+    rows, cols = data.shape
+    return data.reshape(rows // az, az, cols // rg, rg).sum(axis=(1, 3), dtype=np.float32)
+
+
+def derive(i: np.ndarray, q: np.ndarray = None, product: str = "intensity",
+           looks: tuple = (1, 1), block_rows: int = 512) -> np.ndarray:
+    """
+    Intensity / amplitude / phase / dB of SLC data, multilooked during the
+    read
+
+    The input (usually a memmap) is read block by block, each block is
+    reduced into the output before the next one is read, so only the output
+    and two float32 scratch blocks are held in memory. Intensity is averaged
+    over the looks (amplitude and dB are taken from the mean intensity),
+    phase is the angle of the complex sum.
+
+    Parameters
+    ----------
+        - i : complex array, or the I part when `q` is given
+        - q : Q part, for SLC products with separate `i_*`/`q_*` bands
+        - product : 'intensity', 'amplitude', 'phase' or 'db'
+        - looks : (azimuth looks, range looks), incomplete blocks at the
+                  bottom/right edge are dropped
+        - block_rows : input rows per block, rounded to the azimuth looks
+
+    Return
+    ------
+        float32 array of shape (rows // azimuth looks, columns // range looks)
+    """
+    if product not in SLC_PRODUCTS:
+        raise ValueError(f"unknown product '{product}', expected one of {list(SLC_PRODUCTS)}")
+    if q is None and not np.iscomplexobj(i):
+        raise ValueError("derive() needs complex data or both I and Q parts")
+    az, rg = looks
+    height, width = i.shape[0] // az, i.shape[1] // rg
+    if height == 0 or width == 0:
+        raise ValueError(f"looks {looks} are larger than the data {i.shape}")
+
+    out = np.empty((height, width), dtype=np.float32)
+    step = max(block_rows // az, 1) * az
+    buf_a = np.empty((step, width * rg), dtype=np.float32)
+    buf_b = np.empty((step, width * rg), dtype=np.float32)
+    with stage("derive", i.nbytes + (q.nbytes if q is not None else 0)):
+        for r in range(0, height * az, step):
+            rows = min(step, height * az - r)
+            o = out[r // az:(r + rows) // az]
+            if q is None:
+                block = i[r:r + rows, :width * rg]
+                real, imag = block.real, block.imag
+            else:
+                real, imag = i[r:r + rows, :width * rg], q[r:r + rows, :width * rg]
+            a, b = buf_a[:rows], buf_b[:rows]
+
+            if product == "phase":
+                a[...], b[...] = real, imag
+                if az * rg > 1:
+                    a, b = _block_sum(a, az, rg), _block_sum(b, az, rg)
+                np.arctan2(b, a, out=o)
+                continue
+
+            np.square(real, out=a, dtype=np.float32)
+            np.square(imag, out=b, dtype=np.float32)
+            a += b
+            if az * rg > 1:
+                a = _block_sum(a, az, rg)
+                a *= 1.0 / (az * rg)
+            if product == "intensity":
+                o[...] = a
+            elif product == "amplitude":
+                np.sqrt(a, out=o)
+            else:
+                # 强度为 0 的像素取最小正数，避免 log10(0) 的警告
+                np.maximum(a, np.finfo(np.float32).tiny, out=a)
+                np.log10(a, out=o)
+                o *= 10
+    return out
+
+
 class Band:
     """
     Sentine Product band
@@ -25,22 +163,36 @@ class Band:
     ----------
         - data_path : `*.data` folder's path;
         - band_name : name of band
+        - bbox : (min_lon, min_lat, max_lon, max_lat), only read this area
+        - geojson : geojson file, only read the bounding box of its footprint
+        - lazy : keep `radar_pixels` as a memmap in the file's data type
+                 instead of reading it as float64 (complex SLC bands are
+                 always mapped), e.g. for SNAP `i_*`/`q_*` bands
     """
-    def __init__(self, data_path=None, band_name=None) -> None:
+    def __init__(self, data_path=None, band_name=None, bbox=None,
+                 geojson=None, lazy=False) -> None:
         self.name         = band_name
         self.radar_pixels = None
         self.width        = None
         self.height       = None
         self.map_info     = None
+        self.geotransform = None
+        self.window       = None
         self.byte_order   = None
         self.data_t       = None
+        if geojson:
+            bbox = geojson_bbox(geojson)
         if data_path:
-            self._init(data_path)
+            self._init(data_path, bbox, lazy)
 
-    def _init(self, data_path: str) -> None:
+    def _init(self, data_path: str, bbox: tuple = None, lazy: bool = False) -> None:
         self.read_hdr(os.path.join(data_path, f"{self.name}.hdr"))
-        self.radar_pixels = self.read_img(os.path.join(data_path, f"{self.name}.img"))
+        if bbox:
+            self.window = self.bbox_to_window(bbox)
+        read = self.memmap if lazy else self.read_img
+        self.radar_pixels = read(os.path.join(data_path, f"{self.name}.img"), self.window)
 
+    @profiled("Band.read_hdr")
     def read_hdr(self, path: str) -> None:
         """
         read *.hdr file
@@ -69,6 +221,7 @@ class Band:
                     m = re.match(r"map info = {\s*(.*?)\s*}", line)
                     if m:
                         self.map_info = m.group(1); mi_s = False
+                        self.geotransform = parse_map_info(self.map_info)
                 if bo_s:
                     m = re.match(r"byte order = (\d)", line)
                     if m:
@@ -81,31 +234,232 @@ class Band:
                     if m and m.group(1) in DATA_TYPES.keys():
                         self.data_t = DATA_TYPES[m.group(1)]; dt_s = False
 
-    def read_img(self, path: str) -> np.ndarray:
+    def bbox_to_window(self, bbox: tuple) -> tuple:
+        """
+        Geographic bbox -> pixel window
+
+        The window size only depends on the bbox extent and the pixel size,
+        so the same bbox gives same-sized, co-located windows for every
+        acquisition even if their origins differ.
+
+        Parameters
+        ----------
+            bbox : (min_lon, min_lat, max_lon, max_lat)
+
+        Return
+        ------
+            (row_start, row_stop, col_start, col_stop)
+
+        Raises
+        ------
+            ValueError if the bbox is not fully inside the band, a clipped
+            window would not be aligned with the other acquisitions
+        """
+        if self.geotransform is None:
+            raise ValueError(f"band '{self.name}' has no map info, "
+                             "it may not be terrain corrected")
+        x0, dx, _, y0, _, dy = self.geotransform
+        min_x, min_y, max_x, max_y = bbox
+        col = round((min_x - x0) / dx)
+        row = round((max_y - y0) / dy)
+        ncols = round((max_x - min_x) / dx)
+        nrows = round((min_y - max_y) / dy)
+        window = (row, row + nrows, col, col + ncols)
+        if row < 0 or col < 0 or row + nrows > self.height or col + ncols > self.width:
+            raise ValueError(f"bbox {bbox} is not inside band '{self.name}' "
+                             f"(window {window}, band {self.height}x{self.width})")
+        if nrows <= 0 or ncols <= 0:
+            raise ValueError(f"bbox {bbox} is empty")
+        return window
+
+    def _window_geotransform(self) -> tuple:
+        """geotransform of `radar_pixels`, i.e. moved to the window origin"""
+        if not self.geotransform or not self.window:
+            return self.geotransform
+        x0, dx, _, y0, _, dy = self.geotransform
+        return (x0 + self.window[2] * dx, dx, 0.0, y0 + self.window[0] * dy, 0.0, dy)
+
+    def memmap(self, path: str, window: tuple = None) -> np.memmap:
+        """
+        map *.img file without reading it, in the file's data type and byte
+        order
+
+        Parameters
+        ----------
+            path: `.img` file's path
+            window: (row_start, row_stop, col_start, col_stop), only these
+                    rows are mapped, the columns are a view
+
+        Return
+        ------
+            numpy.memmap
+        """
+        dt = np.dtype(self.data_t[1])
+        if self.byte_order == "big":
+            dt = dt.newbyteorder('>')
+        else:
+            dt = dt.newbyteorder('<')
+        r0, r1, c0, c1 = window or (0, self.height, 0, self.width)
+        radar_data = np.memmap(path, dtype=dt, mode='r',
+                               offset=r0 * self.width * dt.itemsize,
+                               shape=(r1 - r0, self.width))
+        return radar_data[:, c0:c1]
+
+    def read_img(self, path: str, window: tuple = None) -> np.ndarray:
         """
         read *.img file
 
+        Real data is read as float64. Complex data (SLC I/Q) is not cast, it
+        is returned as a complex memmap, see `derive()`.
+
         Parameters
         ----------
             path: `.img` file's path
+            window: (row_start, row_stop, col_start, col_stop), only these
+                    pixels are read from disk
         
         Return
         ------
-            None
+            numpy.ndarray
         """
-        with open(path, 'rb') as fr:
-            dt = np.dtype(self.data_t[1])
-            if self.byte_order == "big":
-                dt = dt.newbyteorder('>')
-            else:
-                dt = dt.newbyteorder('<')
-        
-            buf = fr.read(self.width * self.height * self.data_t[0])
-            radar_data = np.frombuffer(buf, dtype=dt)
-        radar_data = np.array(radar_data, dtype=np.float64)
+        if np.dtype(self.data_t[1]).kind == 'c':
+            return self.memmap(path, window)
+
+        dt = np.dtype(self.data_t[1])
+        if self.byte_order == "big":
+            dt = dt.newbyteorder('>')
+        else:
+            dt = dt.newbyteorder('<')
+
+        if window:
+            r0, r1, c0, c1 = window
+            with stage("Band.read_img", (r1 - r0) * self.width * dt.itemsize):
+                return np.array(self.memmap(path, window), dtype=np.float64)
+
+        with stage("Band.read_img") as st:
+            with open(path, 'rb') as fr:
+                buf = fr.read(self.width * self.height * self.data_t[0])
+                radar_data = np.frombuffer(buf, dtype=dt)
+            st.bytes_read = len(buf)
+        with stage("Band.read_img cast"):
+            radar_data = np.array(radar_data, dtype=np.float64)
         # print(radar_data.shape)
         return radar_data.reshape(self.height, self.width)
 
+    def derive(self, product: str = "intensity", looks: tuple = (1, 1),
+               q_band: "Band" = None, block_rows: int = 512) -> "Band":
+        """
+        Intensity / amplitude / phase / dB band of SLC data, multilooked
+
+        Parameters
+        ----------
+            product : one of `SLC_PRODUCTS`
+            looks : (azimuth looks, range looks), i.e. (rows, columns) averaged
+                    into one output pixel
+            q_band : Q band when this band holds I only (SNAP `i_*`/`q_*`
+                     bands), not needed for complex bands
+            block_rows : input rows per block, see `derive()`
+
+        Return
+        ------
+            float32 Band named like SNAP's (e.g. 'Intensity_IW1_VV'), map
+            info scaled by the looks
+        """
+        q = q_band.radar_pixels if q_band is not None else None
+        pixels = derive(self.radar_pixels, q, product, looks, block_rows)
+
+        suffix = re.sub(r"^[iq]_", "", self.name or "")
+        band = Band(band_name=f"{SLC_PRODUCTS[product]}_{suffix}".rstrip("_"))
+        if product == "db":
+            band.name += "_db"
+        band.radar_pixels = pixels
+        band.height, band.width = pixels.shape
+        band.map_info     = self.map_info
+        band.byte_order   = self.byte_order
+        band.data_t       = DATA_TYPES[ENVI_TYPES["float32"]]
+        if self.geotransform:
+            x0, dx, _, y0, _, dy = self._window_geotransform()
+            band.geotransform = (x0, dx * looks[1], 0.0, y0, 0.0, dy * looks[0])
+        return band
+
+    def write(self, data_path: str, data=None, band_name: str = None,
+              dtype: str = None, byte_order: str = None,
+              geotransform: tuple = None, block_rows: int = 512) -> None:
+        """
+        write the band as an ENVI `.hdr`/`.img` pair, readable by SNAP and
+        `Band`
+
+        Parameters
+        ----------
+            data_path : output folder, e.g. a `*.data` folder
+            data : 2-D array (numpy.ndarray or numpy.memmap) or an iterable
+                   of 2-D row blocks, defaults to `radar_pixels`; it is
+                   written block by block, so it may be larger than RAM
+            band_name : defaults to the band's name
+            dtype : numpy dtype name of the output, defaults to the data's
+            byte_order : "big" or "little", defaults to the band's (or little)
+            geotransform : defaults to the band's, moved to `window` when
+                           the band was read from a window (`data` is then
+                           assumed to cover the same window)
+            block_rows : rows per written block (array input)
+
+        Return
+        ------
+            None
+        """
+        name = band_name or self.name
+        if data is None:
+            data = self.radar_pixels
+        if geotransform is None:
+            geotransform = self._window_geotransform()
+        byte_order = byte_order or self.byte_order or "little"
+        if isinstance(data, np.ndarray):
+            blocks = (data[r:r + block_rows] for r in range(0, data.shape[0], block_rows))
+            dtype = dtype or data.dtype.name
+        else:
+            blocks = iter(data)
+
+        if not os.path.exists(data_path):
+            os.makedirs(data_path)
+        width, height = None, 0
+        with stage("Band.write") as st, \
+                open(os.path.join(data_path, f"{name}.img"), 'wb') as fw:
+            for block in blocks:
+                block = np.atleast_2d(block)
+                dtype = dtype or block.dtype.name
+                if dtype not in ENVI_TYPES:
+                    raise ValueError(f"data type '{dtype}' is not supported by ENVI")
+                dt = np.dtype(dtype).newbyteorder('>' if byte_order == "big" else '<')
+                if width is None:
+                    width = block.shape[1]
+                elif block.shape[1] != width:
+                    raise ValueError(f"block width {block.shape[1]} != {width}")
+                buf = np.ascontiguousarray(block, dtype=dt).tobytes()
+                fw.write(buf)
+                st.bytes_written += len(buf)
+                height += block.shape[0]
+        if width is None:
+            raise ValueError("no data to write")
+
+        lines = [
+            "ENVI",
+            f"description = {{Sentinel Tools band {name}}}",
+            f"samples = {width}",
+            f"lines = {height}",
+            "bands = 1",
+            "header offset = 0",
+            "file type = ENVI Standard",
+            f"data type = {ENVI_TYPES[dtype]}",
+            "interleave = bsq",
+            f"byte order = {1 if byte_order == 'big' else 0}",
+            f"band names = {{ {name} }}",
+        ]
+        if geotransform:
+            map_info = self.map_info or "Geographic Lat/Lon, 1, 1, 0, 0, 0, 0, WGS84, units=Degrees"
+            lines.append(f"map info = {{{format_map_info(map_info, geotransform)}}}")
+        with open(os.path.join(data_path, f"{name}.hdr"), 'w') as fw:
+            fw.write("\n".join(lines) + "\n")
+
 
 if __name__ == "__main__":
     data_path = "data/subset_0_of_S1A_IW_GRDH_1SDV_20220131T105217_20220131T105242_041704_04F64F_C18D_Orb.data/"
@@ -0,0 +1,217 @@
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from collections import OrderedDict
+from sentinelsat import SentinelAPI
+
+
+DATE_FIELDS = ("beginposition", "endposition", "ingestiondate", "generationdate")
+
+
+def parse_date(value) -> datetime:
+    """
+    datetime, date, 'yyyyMMdd', 'yyyy-MM-ddThh:mm:ss[.SSS]Z' or 'NOW' -> UTC datetime,
+    None for the other formats accepted by `SentinelAPI.query` (e.g. 'NOW-1DAY')
+    """
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    if value == "NOW":
+        return datetime.now(timezone.utc)
+    for fmt in ("%Y%m%d", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.%fZ"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class Catalog:
+    """
+    Local SQLite catalog of `SentinelAPI.query` results
+
+    Results are keyed by the footprint WKT and the query filters. For every
+    key the catalog remembers which date intervals have been queried, so a
+    later query only asks the hub for the part of the date range not yet
+    covered. The most recent `lag` is never marked as covered, because
+    products are still being ingested there.
+
+    Parameters
+    ----------
+        - path : sqlite file's path
+        - lag : recent interval that is always queried again
+    """
+    def __init__(self, path: str, lag: timedelta = timedelta(days=3)) -> None:
+        self.path = path
+        self.lag  = lag
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                uuid TEXT PRIMARY KEY,
+                title TEXT,
+                platformname TEXT,
+                producttype TEXT,
+                orbitdirection TEXT,
+                beginposition TEXT,
+                footprint TEXT,
+                size TEXT,
+                metadata TEXT
+            );
+            CREATE TABLE IF NOT EXISTS query_products (
+                query_key TEXT,
+                uuid TEXT,
+                PRIMARY KEY (query_key, uuid)
+            );
+            CREATE TABLE IF NOT EXISTS coverage (
+                query_key TEXT,
+                start TEXT,
+                end TEXT
+            );
+            CREATE INDEX IF NOT EXISTS products_begin ON products (beginposition);
+        """)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @staticmethod
+    def query_key(footprint: str, **filters) -> str:
+        """key of a query: sha1 of the footprint WKT and the filters"""
+        items = {k: str(v).lower() for k, v in filters.items() if v is not None}
+        text = json.dumps([footprint, sorted(items.items())])
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def query(self, api: SentinelAPI, footprint: str, date: tuple,
+              **filters) -> OrderedDict:
+        """
+        Same as `api.query(footprint, date=date, **filters)`, but the hub is
+        only queried for the date intervals missing from the catalog
+
+        Return
+        ------
+            OrderedDict of product UUID -> metadata, sorted by sensing time
+        """
+        key = self.query_key(footprint, **filters)
+        start, end = parse_date(date[0]), parse_date(date[1])
+        if start is None or end is None:
+            # 无法解析的日期格式, 直接查询并缓存结果
+            products = api.query(footprint, date=date, **filters)
+            self._store(key, products)
+            return products
+
+        now = datetime.now(timezone.utc)
+        for gap_start, gap_end in self.missing(key, start, end):
+            print(f"querying {gap_start:%Y-%m-%d %H:%M} - {gap_end:%Y-%m-%d %H:%M}")
+            products = api.query(footprint, date=(gap_start, gap_end), **filters)
+            self._store(key, products)
+            covered_end = min(gap_end, now - self.lag)
+            if covered_end > gap_start:
+                self._cover(key, gap_start, covered_end)
+        return self.products(key, start, end)
+
+    def missing(self, key: str, start: datetime, end: datetime) -> list:
+        """date intervals in [start, end] that are not covered for `key`"""
+        gaps, cursor = [], start
+        for c_start, c_end in self._coverage(key):
+            if c_end <= cursor:
+                continue
+            if c_start >= end:
+                break
+            if c_start > cursor:
+                gaps.append((cursor, c_start))
+            cursor = max(cursor, c_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def products(self, key: str = None, start=None, end=None,
+                 **filters) -> OrderedDict:
+        """
+        Filter the catalog offline
+
+        Parameters
+        ----------
+            - key : only products returned by this query (see `query_key`)
+            - start, end : sensing start time interval
+            - filters : column == value, for `platformname`, `producttype`,
+                        `orbitdirection` (case-insensitive)
+
+        Return
+        ------
+            OrderedDict of product UUID -> metadata, sorted by sensing time
+        """
+        sql, args = "SELECT p.uuid, p.metadata FROM products p", []
+        where = []
+        if key:
+            sql += " JOIN query_products q ON q.uuid = p.uuid"
+            where.append("q.query_key = ?"); args.append(key)
+        if start is not None:
+            where.append("p.beginposition >= ?"); args.append(parse_date(start).isoformat())
+        if end is not None:
+            where.append("p.beginposition <= ?"); args.append(parse_date(end).isoformat())
+        for column, value in filters.items():
+            if column not in ("platformname", "producttype", "orbitdirection"):
+                raise ValueError(f"unknown filter: {column}")
+            where.append(f"lower(p.{column}) = ?"); args.append(str(value).lower())
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY p.beginposition"
+        res = OrderedDict()
+        for uuid, metadata in self.conn.execute(sql, args):
+            res[uuid] = self._decode(metadata)
+        return res
+
+    def _coverage(self, key: str) -> list:
+        rows = self.conn.execute(
+            "SELECT start, end FROM coverage WHERE query_key = ? ORDER BY start", (key,))
+        return [(datetime.fromisoformat(s), datetime.fromisoformat(e)) for s, e in rows]
+
+    def _cover(self, key: str, start: datetime, end: datetime) -> None:
+        """add [start, end] to the coverage of `key`, merging overlaps"""
+        intervals = self._coverage(key) + [(start, end)]
+        intervals.sort()
+        merged = [intervals[0]]
+        for s, e in intervals[1:]:
+            if s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        with self.conn:
+            self.conn.execute("DELETE FROM coverage WHERE query_key = ?", (key,))
+            self.conn.executemany(
+                "INSERT INTO coverage VALUES (?, ?, ?)",
+                [(key, s.isoformat(), e.isoformat()) for s, e in merged])
+
+    def _store(self, key: str, products: OrderedDict) -> None:
+        rows = []
+        for uuid, info in products.items():
+            begin = info.get("beginposition")
+            rows.append((uuid, info.get("title"), info.get("platformname"),
+                         info.get("producttype"), info.get("orbitdirection"),
+                         parse_date(begin).isoformat() if begin else None,
+                         info.get("footprint"), info.get("size"),
+                         json.dumps(info, default=self._encode)))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO query_products VALUES (?, ?)",
+                [(key, uuid) for uuid in products])
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def _decode(metadata: str) -> dict:
+        info = json.loads(metadata)
+        for field in DATE_FIELDS:
+            if isinstance(info.get(field), str):
+                info[field] = datetime.fromisoformat(info[field])
+        return info
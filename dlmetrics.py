@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+
+
+class DownloadMetrics:
+    """
+    Per-product download metrics with aggregate counters
+
+    A record per product (bytes, duration, throughput, attempts, errors, LTA
+    wait) is appended to `<path>.jsonl` when the product is finished, and the
+    aggregate counters are rewritten to `<path>.prom` in the Prometheus
+    textfile format (e.g. for the node_exporter textfile collector).
+
+    Parameters
+    ----------
+        - path : path prefix of the metric files, None to keep them in memory
+    """
+    def __init__(self, path: str = None) -> None:
+        self.path     = path
+        self.products = {}
+        self.counters = {
+            "bytes": 0,              # 下载的字节数
+            "seconds": 0.0,          # 下载耗时 (所有线程之和)
+            "status": {},            # 完成/失败的产品数
+            "errors": {},            # 各类错误的次数
+            "sleep": {},             # time.sleep 等待的时间
+            "lta_wait": 0.0,         # LTA 请求到产品上线的时间
+        }
+        self._lock = threading.Lock()
+        if path and os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+    def _product(self, pid: str) -> dict:
+        if pid not in self.products:
+            self.products[pid] = {"id": pid, "title": None, "bytes": 0,
+                                  "duration": 0.0, "attempts": 0, "errors": {},
+                                  "lta_requested": None, "lta_wait": 0.0}
+        return self.products[pid]
+
+    def attempt(self, pid: str, title: str, nbytes: int, duration: float,
+                error: str = None) -> None:
+        """
+        Record one download attempt
+
+        Parameters
+        ----------
+            - pid : product ID
+            - title : product title
+            - nbytes : bytes downloaded, 0 for a failed attempt
+            - duration : seconds spent in the attempt
+            - error : error class of a failed attempt, e.g. 'InvalidChecksumError'
+        """
+        with self._lock:
+            product = self._product(pid)
+            product["title"] = title or product["title"]
+            product["attempts"] += 1
+            product["bytes"] += nbytes
+            product["duration"] += duration
+            self.counters["bytes"] += nbytes
+            self.counters["seconds"] += duration
+            if error:
+                product["errors"][error] = product["errors"].get(error, 0) + 1
+                self.counters["errors"][error] = self.counters["errors"].get(error, 0) + 1
+
+    def sleep(self, seconds: float, reason: str) -> None:
+        """`time.sleep` that is counted, `reason` e.g. 'retry'"""
+        time.sleep(seconds)
+        with self._lock:
+            self.counters["sleep"][reason] = self.counters["sleep"].get(reason, 0) + seconds
+
+    def lta_requested(self, pid: str) -> None:
+        with self._lock:
+            product = self._product(pid)
+            if product["lta_requested"] is None:
+                product["lta_requested"] = time.time()
+
+    def lta_online(self, pid: str) -> None:
+        with self._lock:
+            product = self._product(pid)
+            if product["lta_requested"] is not None:
+                wait = time.time() - product["lta_requested"]
+                product["lta_wait"] += wait
+                product["lta_requested"] = None
+                self.counters["lta_wait"] += wait
+
+    def finish(self, pid: str, status: str) -> None:
+        """
+        Close the record of a product and export the metrics
+
+        Parameters
+        ----------
+            - pid : product ID
+            - status : 'done' or 'failed'
+        """
+        with self._lock:
+            product = self._product(pid)
+            product["status"] = status
+            product["throughput"] = product["bytes"] / product["duration"] \
+                if product["duration"] else 0.0
+            product["finished"] = time.time()
+            self.counters["status"][status] = self.counters["status"].get(status, 0) + 1
+            if self.path:
+                with open(self.path + ".jsonl", 'a') as fw:
+                    fw.write(json.dumps(product) + "\n")
+                self._write_prom()
+
+    def summary(self) -> dict:
+        """aggregate counters and mean throughput (bytes/s)"""
+        with self._lock:
+            res = json.loads(json.dumps(self.counters))
+            res["throughput"] = self.counters["bytes"] / self.counters["seconds"] \
+                if self.counters["seconds"] else 0.0
+            return res
+
+    def _write_prom(self) -> None:
+        c = self.counters
+        lines = [
+            "# HELP sentinel_download_bytes_total Bytes of downloaded products.",
+            "# TYPE sentinel_download_bytes_total counter",
+            f"sentinel_download_bytes_total {c['bytes']}",
+            "# HELP sentinel_download_seconds_total Time spent downloading, summed over threads.",
+            "# TYPE sentinel_download_seconds_total counter",
+            f"sentinel_download_seconds_total {c['seconds']:.3f}",
+            "# HELP sentinel_download_products_total Finished products by status.",
+            "# TYPE sentinel_download_products_total counter",
+        ]
+        lines += [f'sentinel_download_products_total{{status="{k}"}} {v}'
+                  for k, v in c["status"].items()]
+        lines += [
+            "# HELP sentinel_download_errors_total Failed download attempts by error class.",
+            "# TYPE sentinel_download_errors_total counter",
+        ]
+        lines += [f'sentinel_download_errors_total{{error="{k}"}} {v}'
+                  for k, v in c["errors"].items()]
+        lines += [
+            "# HELP sentinel_download_sleep_seconds_total Time spent sleeping by reason.",
+            "# TYPE sentinel_download_sleep_seconds_total counter",
+        ]
+        lines += [f'sentinel_download_sleep_seconds_total{{reason="{k}"}} {v:.3f}'
+                  for k, v in c["sleep"].items()]
+        lines += [
+            "# HELP sentinel_lta_wait_seconds_total Time from LTA request to product online.",
+            "# TYPE sentinel_lta_wait_seconds_total counter",
+            f"sentinel_lta_wait_seconds_total {c['lta_wait']:.3f}",
+            "# HELP sentinel_download_throughput_bytes Mean download throughput (bytes/s).",
+            "# TYPE sentinel_download_throughput_bytes gauge",
+            f"sentinel_download_throughput_bytes "
+            f"{c['bytes'] / c['seconds'] if c['seconds'] else 0:.1f}",
+        ]
+        tmp_path = self.path + ".prom.tmp"
+        with open(tmp_path, 'w') as fw:
+            fw.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path + ".prom")
@@ -2,11 +2,21 @@
 
 import os
 import time
+import threading
 from collections import OrderedDict
 from multiprocessing import Process, Lock, Value
+from multiprocessing.connection import wait
+import requests
+from requests.adapters import HTTPAdapter
 # sentinelsat中导入相关的模块
 from sentinelsat import SentinelAPI, read_geojson, geojson_to_wkt
 from sentinelsat.exceptions import LTATriggered, ServerError, InvalidChecksumError, LTAError
+from rangedownloader import RangeDownloader
+from ltascheduler import LTAScheduler
+from catalog import Catalog
+from footprint_coverage import filter_coverage
+from dlmetrics import DownloadMetrics
+from jobledger import JobLedger, PENDING, DOWNLOADING, OFFLINE, DONE, FAILED
 
 
 class UserParameter:
@@ -48,6 +58,28 @@ class UserParameter:
         defaults to 'https://scihub.copernicus.eu/dhus'
     save_path : string
         save path for downdoaded products
+    workers : int
+        number of products downloaded concurrently, 1 for sequential download
+    segments : int
+        number of parallel range requests per product, 0 to download with
+        `SentinelAPI.download`
+    lta_quota : int
+        maximum number of LTA requests in flight for the user
+    lta_poll : float
+        first polling interval (seconds) of a product whose LTA retrieval
+        was requested, backed off up to 30 minutes
+    catalog_path : string, optional
+        SQLite catalog of query results, only the date interval not yet in
+        the catalog is queried from the DataHub
+    ledger_path : string, optional
+        job ledger with the state of every product, a restarted download
+        resumes from it, defaults to `<save_path>/download_ledger.json`
+    min_coverage : float
+        products whose footprint covers less than this part of `footprint`
+        (0 ~ 1) are not downloaded
+    metrics_path : string, optional
+        path prefix of the download metrics, `<metrics_path>.jsonl` (one
+        record per product) and `<metrics_path>.prom` (Prometheus textfile)
 
     """
     def __init__(
@@ -60,7 +92,15 @@ class UserParameter:
         product_type: str='SLC',
         orbit_direction: str='ASCENDING',
         api_url: str='https://scihub.copernicus.eu/dhus', 
-        save_path: str = None
+        save_path: str = None,
+        workers: int = 1,
+        segments: int = 0,
+        lta_quota: int = 20,
+        lta_poll: float = 60,
+        catalog_path: str = None,
+        ledger_path: str = None,
+        min_coverage: float = 0,
+        metrics_path: str = None
     ) -> None:
         self.user = user
         self.password = password
@@ -76,145 +116,116 @@ class UserParameter:
                                     time.strftime("%Y%m%dT%H%M%S", time.localtime()))
         else:
             self.save_path = save_path
+        self.workers = workers
+        self.segments = segments
+        self.lta_quota = lta_quota
+        self.lta_poll = lta_poll
+        self.catalog_path = catalog_path
+        self.ledger_path = ledger_path or os.path.join(self.save_path,
+                                                       "download_ledger.json")
+        self.min_coverage = min_coverage
+        self.metrics_path = metrics_path
 
 
-def download_data(api: SentinelAPI, product: str, save_path: str) -> int:
+def download_data(api: SentinelAPI, product: str, save_path: str,
+                  engine: RangeDownloader = None,
+                  metrics: DownloadMetrics = None) -> int:
     """download data of sentinel
     Parameters
     ----------
     `api` : SentinelAPI
     `product` : ID of product that created by SentinelAPI.query()
     `save_path`: save path for downloaded products
+    `engine` : download online products in range segments with this
+               downloader, a failed download resumes from its `.incomplete` file
+    `metrics` : record bytes, duration and error class of the attempt
     """
+    started, title = time.time(), None
     try:
         #通过 OData API 获取单一产品数据的主要元数据信息
         product_info = api.get_product_odata(product)
-        print(product_info['title'])
-        #下载产品id为product的产品数据
-        api.download(product, directory_path=save_path)
-    except LTATriggered:
-        print(f"Product {product_info['title']} is not online. \
-                    Will try to download again after 30 minutes.")
-        time.sleep(3)
-        return -1
-    except (InvalidChecksumError, ServerError):
-        time.sleep(3)
-        return -2
-    except LTAError:
-        time.sleep(3)
-        return -3
+        title = product_info['title']
+        print(title)
+        #下载产品id为product的产品数据, nbytes 为本次实际传输的字节数
+        if engine and product_info['Online']:
+            nbytes = engine.download(product_info['url'],
+                                     os.path.join(save_path, title + '.zip'),
+                                     product_info['size'], product_info['md5'])
+        else:
+            # 离线产品由 api.download 触发 LTA 请求
+            nbytes = api.download(product, directory_path=save_path).get('downloaded_bytes', 0)
+    except LTATriggered as e:
+        print(f"Product {title} is not online, queued for LTA polling.")
+        res, error = -1, e
+    except (InvalidChecksumError, ServerError, requests.RequestException) as e:
+        res, error = -2, e
+    except LTAError as e:
+        res, error = -3, e
     # except Exception:
     # 	time.sleep(5)
     # 	return -2
     else:
+        if metrics:
+            metrics.attempt(product, title, nbytes, time.time() - started)
         return 0
 
+    if metrics:
+        metrics.attempt(product, title, 0, time.time() - started, type(error).__name__)
+        metrics.sleep(3, "retry")
+    else:
+        time.sleep(3)
+    return res
+
+
+def share_session(api: SentinelAPI, workers: int) -> None:
+    """让所有下载线程复用 api 的 session，连接池大小与线程数一致
 
-def download_LTA(api: SentinelAPI, LTA_list: list, product_ids: list, 
-                lock: Lock, total: Value, remain: Value, max_times: int=3) -> None:
-    """下载LTA产品
     Parameters
     ----------
     `api` : SentinelAPI
-    `LTA_list` : LTA list for current user
-    `product_ids` : a list for product IDs
-    `total` : total of product queried
-    `remain` : remain of produtcts
-    `max_times` : maxium attempts
+    `workers` : number of download threads
     """
-    remain_dl_times = 3   # 对于 LAT 产品的最大尝试下载次数
-    while LTA_list  and remain_dl_times > 0:
-        # 等待 30 分钟再开始尝试重新下载 LTA 产品
-        print("\n*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#*#")
-        print("\033[34mWaiting to download LTA products... ({})\033[0m".format(
-                            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
-        time.sleep(60 * 30)
-        print("\n**********************************************************")
-        print("\033[34mNow try to download LTA products... ({})\033[0m".format(
-                            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
-        tmp_list = LTA_list.copy()
-        for current_id in tmp_list:
-            cnt = 0
-            while True:
-                print(f'[{number}/{total.value}]', end=" ")
-                if cnt >= max_times:
-                    break
-                
-                res = download_data(api, current_id)
-                if res == 0:
-                    number += 1
-                    lock.acquire()
-                    remain.value -= 1
-                    lock.release()
-                    LTA_list.remove(current_id)
-                    product_ids.remove(current_id)
-                    break
-                elif res == -1:
-                    break
-                cnt += 1
-        remain_dl_times -= 1
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    api.session.mount('http://', adapter)
+    api.session.mount('https://', adapter)
+
 
+def query_products(api: SentinelAPI, params: UserParameter) -> OrderedDict:
+    """查询符合条件的所有产品
 
-def download(api: SentinelAPI, products: OrderedDict, lock: Lock, 
-             total: Value, remain: Value, save_path, max_times: int=3) -> None:
-    """下载所有产品
     Parameters
     ----------
     `api` : SentinelAPI
-    `products` : Sentinel product that obtained by SentinelAPI.query()
-    `total` : total of product queried
-    `remain` : remain of produtcts
-    `save_path`: save path for downloaded products
-    `max_times` : maxium attempts
+    `params`  : user parameters
     """
-    lock.acquire()
-    total.value = len(products)
-    remain.value = len(products)
-    lock.release()
-    print(f'remain in action: {remain.value}')
-    print("Total: {} products".format(len(products)))
-
-    if products:
-        product_ids = list(products.keys())
+    # 通过设置 OpenSearch API 查询参数筛选符合条件的所有 Sentinel-1L2A 级数据
+    query_filters = dict(
+                platformname=params.platform_name,     # 卫星平台名，Sentinel-1                    
+                producttype=params.product_type,       # 产品数据等级，'S2MSI2A'表示 S2-L2A 级产品
+                orbitdirection=params.orbit_direction  # 升降轨选择，A 为升轨, Descending 为降轨 
+            )
+    if params.catalog_path:
+        # 只查询本地目录中还没有的日期范围
+        catalog = Catalog(params.catalog_path)
+        products = catalog.query(api, params.footprint, params.date, **query_filters)
+        catalog.close()
     else:
-        return
-
-    LTA_list  = []     # Long Term Archivel 缓存
-    # 通过for循环遍历并打印、下载出搜索到的产品文件名
-    is_LTA_limit = False
-    number = 1
-    while product_ids:
-        for current_id in product_ids:
-            cnt = 0
-            while True:
-                print(f'[{number}/{total.value}]', end=" ")
-                if cnt >= max_times:
-                    break
-
-                res = download_data(api, current_id, save_path)
-                if res == 0:
-                    number += 1
-                    lock.acquire()
-                    remain.value -= 1
-                    lock.release()
-                    product_ids.remove(current_id)
-                    break
-                elif res == -1:
-                    LTA_list.append(current_id)
-                    break
-                elif res == -3:
-                    is_LTA_limit = True
-                    break
-                cnt += 1
-            # LTA 单用户的产品配额为20, 需要隔一段时间才会重新分配
-            if (len(LTA_list) >= 20 or is_LTA_limit): 
-                break
-    download_LTA(api, LTA_list, product_ids, lock, total, remain, max_times)
+        products = api.query(params.footprint, date=params.date, **query_filters)
+    if params.min_coverage > 0:
+        # 丢弃只覆盖了研究区边角的产品
+        products, dropped, avoided = filter_coverage(products, params.footprint,
+                                                     params.min_coverage)
+        print(f"{len(dropped)} products cover less than {params.min_coverage:.0%} "
+              f"of the area, {avoided / 1024 ** 3:.2f} GB not downloaded")
+    return products
 
 
 def action(lock: Lock, params: UserParameter, total: Value, remain: Value) -> None:
     """下载主程序
 
+    产品列表及每个产品的状态保存在 `params.ledger_path` 中, 重启后直接从中恢复,
+    不再重新查询 (删除该文件即可重新查询)
+
     Parameters
     ----------
     `lock` : multiprocessing.Lock
@@ -226,43 +237,86 @@ def action(lock: Lock, params: UserParameter, total: Value, remain: Value) -> No
         os.makedirs(params.save_path)
     # 创建SentinelAPI, 请使用哥白尼数据开放获取中心自己的用户名及密码
     api = SentinelAPI(params.user, params.password, params.api_url)
-    # 通过设置 OpenSearch API 查询参数筛选符合条件的所有 Sentinel-1L2A 级数据
-    products = api.query(
-                params.footprint,                      # Area 范围
-                date=params.date,  # 搜索的日期范围
-                platformname=params.platform_name,     # 卫星平台名，Sentinel-1                    
-                producttype=params.product_type,       # 产品数据等级，'S2MSI2A'表示 S2-L2A 级产品
-                orbitdirection=params.orbit_direction  # 升降轨选择，A 为升轨, Descending 为降轨 
-            )            
-    # 下载所有产品
-    download(api, products, lock, total, remain, params.save_path, 3)
+    ledger = JobLedger(params.ledger_path)
+    if not ledger.keys():
+        # 一次写入全部产品: 逐个写入时若中途退出, 账本只有部分产品, 重启后不会再查询
+        products = query_products(api, params)
+        ledger.add_many({pid: {"title": info.get('title')} for pid, info in products.items()})
+    else:
+        print(f"Resuming from {params.ledger_path}: {ledger.counts()}")
+
+    max_times = 3
+    # 上次中断时正在下载的产品优先, 断点续传
+    todo = ledger.keys(DOWNLOADING) + ledger.keys(PENDING) + \
+        [pid for pid in ledger.keys(FAILED) if ledger.get(pid)['attempts'] < max_times]
+    # 分段并行下载在线产品
+    engine = RangeDownloader(api.session, params.segments) if params.segments else None
+    metrics = DownloadMetrics(params.metrics_path)
+    # 下载所有产品, 离线产品提交 LTA 请求后在线产品继续下载
+    scheduler = LTAScheduler(
+                    api,
+                    lambda pid: download_data(api, pid, params.save_path, engine, metrics),
+                    lock, total, remain,
+                    workers=params.workers,
+                    quota=params.lta_quota,
+                    max_times=max_times,
+                    base_delay=params.lta_poll,
+                    ledger=ledger,
+                    metrics=metrics
+                )
+    share_session(api, params.workers * max(params.segments, 1) + 1)
+    scheduler.run(todo, requested=ledger.keys(OFFLINE),
+                  finished=len(ledger.keys(DONE)))
+    summary = metrics.summary()
+    print(f"Downloaded {summary['bytes'] / 1024 ** 3:.2f} GB at "
+          f"{summary['throughput'] / 1024 ** 2:.2f} MB/s per product, "
+          f"errors: {summary['errors']}, LTA wait: {summary['lta_wait'] / 60:.1f} min")
 
 
-def check(lock: Lock, params: UserParameter):
+def check(lock: Lock, params: UserParameter, stop: threading.Event = None):
     """ 检查下载子进程是否存活
 
+    子进程异常退出时立即重启, 新进程从 ledger 中恢复下载状态
+
     Parameters
     ----------
     `lock` : multiprocessing.Lock
     `params`  : user parameters
+    `stop` : set it (e.g. from another thread) to terminate the download
+             process and return without respawning
     """
-    # 剩余的产品数量 (初始化为-1，使之进入 check() 函数的 while 循环)
+    stop = stop or threading.Event()
+    # 剩余的产品数量
     remain = Value('i', -1)
     # 总产品数
     total = Value('i', 0)
-    # '下载'子进程
-    download_process = Process(target=action, args=(lock, params, total, remain))
-    download_process.start()
-    while remain.value == -1 or remain.value > 0:
-        if not download_process.is_alive():
-            print("\n\033[1;33mWARN: Creating a new subprocessing now!\033[0m")
-            download_process.close()
-            download_process = Process(target=action, args=(lock, params, total, remain))
-            download_process.start()
-        # print(f'remain in check: {remain.value}')
-        time.sleep(60 * 2)   # 每2分钟检查一次下载进程是否存活
-    print("\nAll products downloaded successfully.\n\n--Bye.")
-    download_process.close()
+    respawn_delay = 5     # 连续重启的等待时间 (秒), 避免网络断开时频繁重启
+    while not stop.is_set():
+        # '下载'子进程
+        download_process = Process(target=action, args=(lock, params, total, remain))
+        started = time.time()
+        download_process.start()
+        # 子进程退出时 sentinel 立即就绪, 同时每秒检查一次 stop
+        while not wait([download_process.sentinel], timeout=1):
+            if stop.is_set():
+                download_process.terminate()
+        download_process.join()
+        exitcode = download_process.exitcode
+        download_process.close()
+        if exitcode == 0 or stop.is_set():
+            break
+        if time.time() - started > 60 * 10:
+            respawn_delay = 5
+        print(f"\n\033[1;33mWARN: download process exited with {exitcode}, "
+              f"creating a new subprocessing in {respawn_delay}s!\033[0m")
+        stop.wait(respawn_delay)
+        respawn_delay = min(respawn_delay * 2, 60 * 2)
+
+    counts = JobLedger(params.ledger_path).counts()
+    if counts.get(FAILED) or counts.get(OFFLINE) or counts.get(PENDING):
+        print(f"\nFinished with unfinished products: {counts}\n\n--Bye.")
+    else:
+        print("\nAll products downloaded successfully.\n\n--Bye.")
 
 
 if __name__ == '__main__':
@@ -280,6 +334,11 @@ if __name__ == '__main__':
     platformname   = 'Sentinel-1'              # 卫星平台名，Sentinel-1                    
     producttype    = 'SLC'                     # 产品数据等级，'S2MSI2A'表示 S2-L2A 级产品
     orbitdirection = 'Ascending'               # 升降轨选择，A 为升轨, Descending 为降轨 
+    workers        = 4                         # 同时下载的产品数
+    segments       = 4                         # 每个产品的分段下载数
+    catalog_path   = os.path.join("Products", "catalog.sqlite")   # 查询结果的本地目录
+    min_coverage   = 0.8                       # 产品覆盖研究区的最小比例
+    metrics_path   = os.path.join("Products", area_name + "_metrics")   # 下载统计
 
     parameters = UserParameter(
                         user_name, 
@@ -290,7 +349,12 @@ if __name__ == '__main__':
                         producttype,
                         orbitdirection,
                         api_url, 
-                        save_path
+                        save_path,
+                        workers,
+                        segments,
+                        catalog_path=catalog_path,
+                        min_coverage=min_coverage,
+                        metrics_path=metrics_path
                     )
  
     # 设置代理环境变量
@@ -0,0 +1,139 @@
+import re
+from collections import OrderedDict
+
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+def parse_wkt(wkt: str) -> list:
+    """
+    POLYGON / MULTIPOLYGON WKT -> list of outer rings [(x, y), ...]
+
+    Holes are ignored, they do not occur in product footprints.
+    """
+    rings = []
+    for polygon in re.findall(r"\(\(\s*([^()]+?)\s*\)", wkt):
+        ring = [tuple(float(v) for v in point.split()[:2])
+                for point in polygon.split(",")]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        rings.append(ring)
+    return rings
+
+
+def polygon_area(ring: list) -> float:
+    """signed area (shoelace), positive for counter-clockwise rings"""
+    area = 0.0
+    for i in range(len(ring)):
+        x1, y1 = ring[i - 1]
+        x2, y2 = ring[i]
+        area += x1 * y2 - x2 * y1
+    return area / 2
+
+
+def convex_hull(points: list) -> list:
+    """counter-clockwise convex hull (monotone chain)"""
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def clip(subject: list, convex: list) -> list:
+    """
+    Intersection of any polygon with a counter-clockwise convex polygon
+    (Sutherland-Hodgman)
+    """
+    def inside(p, a, b):
+        return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0]) >= 0
+
+    def intersection(p, q, a, b):
+        dx1, dy1 = q[0] - p[0], q[1] - p[1]
+        dx2, dy2 = b[0] - a[0], b[1] - a[1]
+        t = ((a[0] - p[0]) * dy2 - (a[1] - p[1]) * dx2) / (dx1 * dy2 - dy1 * dx2)
+        return (p[0] + t * dx1, p[1] + t * dy1)
+
+    output = subject
+    for i in range(len(convex)):
+        a, b = convex[i - 1], convex[i]
+        points, output = output, []
+        for j in range(len(points)):
+            p, q = points[j - 1], points[j]
+            if inside(q, a, b):
+                if not inside(p, a, b):
+                    output.append(intersection(p, q, a, b))
+                output.append(q)
+            elif inside(p, a, b):
+                output.append(intersection(p, q, a, b))
+        if not output:
+            break
+    return output
+
+
+def coverage_ratio(aoi_wkt: str, footprint_wkt: str) -> float:
+    """
+    Part of the area of interest covered by a product footprint, in [0, 1]
+
+    Areas are computed in lon/lat, which is accurate enough for a ratio
+    over areas of a few hundred kilometers. Footprints are treated as their
+    convex hull (Sentinel footprints are convex quadrilaterals).
+    """
+    aoi = parse_wkt(aoi_wkt)
+    footprints = [convex_hull(ring) for ring in parse_wkt(footprint_wkt)]
+    total = sum(abs(polygon_area(ring)) for ring in aoi)
+    if total == 0:
+        return 0.0
+    covered = 0.0
+    for ring in aoi:
+        for footprint in footprints:
+            if len(footprint) >= 3:
+                covered += abs(polygon_area(clip(ring, footprint)))
+    return min(covered / total, 1.0)
+
+
+def size_to_bytes(size: str) -> int:
+    """product size from the query metadata, e.g. '1.65 GB' -> bytes"""
+    m = re.match(r"^\s*([\d.]+)\s*([KMGT]?B)\s*$", str(size), re.I)
+    if not m:
+        return 0
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def filter_coverage(products: OrderedDict, aoi_wkt: str,
+                    min_ratio: float) -> tuple:
+    """
+    Drop products whose footprint covers less than `min_ratio` of the area
+    of interest, before anything is downloaded
+
+    Parameters
+    ----------
+        - products : result of `SentinelAPI.query()`
+        - aoi_wkt : area of interest, e.g. `UserParameter.footprint`
+        - min_ratio : minimum covered part of the area of interest, in [0, 1]
+
+    Return
+    ------
+        (kept products, IDs of dropped products, bytes avoided)
+    """
+    kept, dropped, avoided = OrderedDict(), [], 0
+    for pid, info in products.items():
+        footprint = info.get("footprint")
+        if footprint and coverage_ratio(aoi_wkt, footprint) < min_ratio:
+            dropped.append(pid)
+            avoided += size_to_bytes(info.get("size"))
+        else:
+            kept[pid] = info
+    return kept, dropped, avoided
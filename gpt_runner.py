@@ -0,0 +1,204 @@
+### 并行调用 SNAP 的 gpt 处理产品，作用同 dataCropping_snap.sh，但可以同时运行多个 gpt 进程，
+### 并把每个产品的处理状态记录在 ledger 文件中，中断后重新运行会跳过已经处理完成的产品。
+### 用法示例：
+###     python gpt_runner.py --graph SangGenDaLai_Lake1.xml --products Products/lake1/ \
+###         --dest subset_snap/ --max-memory 24 --max-cpus 8 -q 4 -c 4G
+
+import os
+import re
+import glob
+import signal
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
+from jobledger import JobLedger, PENDING, RUNNING, DONE, FAILED
+
+
+def parse_size(size: str) -> float:
+    """
+    '4G', '512M', '2048' (MB) -> size in GB
+    """
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(size), re.I)
+    if not m:
+        raise ValueError(f"invalid size: {size}")
+    value, unit = float(m.group(1)), m.group(2).upper()
+    return value * {"K": 1 / 1024 ** 2, "M": 1 / 1024, "": 1 / 1024,
+                    "G": 1, "T": 1024}[unit]
+
+
+def plan_slots(max_memory: float, max_cpus: int, job_memory: float,
+               threads: int) -> int:
+    """
+    Number of gpt processes that fit in the RAM/CPU budget
+
+    Parameters
+    ----------
+        - max_memory : RAM budget for all jobs (GB)
+        - max_cpus : CPU budget for all jobs
+        - job_memory : RAM taken by one gpt process (GB), i.e. its JVM heap
+        - threads : `-q` parallelism of one gpt process
+    """
+    by_mem = int(max_memory // job_memory) if job_memory > 0 else max_cpus
+    by_cpu = max_cpus // max(threads, 1)
+    return max(1, min(by_mem, by_cpu))
+
+
+class GptRunner:
+    """
+    Run a SNAP graph (e.g. `SangGenDaLai_Lake1.xml`) over many products with
+    several concurrent gpt processes
+
+    Parameters
+    ----------
+        - graph_path : SNAP graph file with `$input` and `$output` variables
+        - save_path : folder of output products
+        - ledger_path : job ledger file, defaults to `<save_path>/gpt_ledger.json`
+        - gpt : gpt executable
+        - slots : number of concurrent gpt processes
+        - threads : `-q` option of gpt
+        - cache : `-c` option of gpt, e.g. '4G'
+        - max_times : maximum attempts of one product
+    """
+    def __init__(self, graph_path: str, save_path: str, ledger_path: str = None,
+                 gpt: str = "gpt", slots: int = 1, threads: int = None,
+                 cache: str = None, max_times: int = 2) -> None:
+        self.graph_path = graph_path
+        self.save_path  = save_path
+        self.gpt        = gpt
+        self.slots      = slots
+        self.threads    = threads
+        self.cache      = cache
+        self.max_times  = max_times
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        self.ledger = JobLedger(ledger_path or
+                                os.path.join(save_path, "gpt_ledger.json"))
+        self._procs = set()
+        self._lock  = threading.Lock()
+        self._stop  = threading.Event()
+        self._number = 0
+
+    def output_path(self, product: str) -> str:
+        file_name = os.path.basename(product).removesuffix(".zip")
+        return os.path.join(self.save_path, f"Subset_{file_name}.dim")
+
+    def command(self, product: str) -> list:
+        cmd = [self.gpt, self.graph_path]
+        if self.threads:
+            cmd += ["-q", str(self.threads)]
+        if self.cache:
+            cmd += ["-c", str(self.cache)]
+        cmd += [f"-Pinput={product}", f"-Poutput={self.output_path(product)}"]
+        return cmd
+
+    def run(self, products: list) -> dict:
+        """
+        Process `products` and return the job counts of the ledger
+
+        Jobs interrupted by a previous run are requeued, finished jobs are
+        skipped and every other job gets up to `max_times` attempts.
+        """
+        for product in products:
+            self.ledger.add(product, output=self.output_path(product))
+        self.ledger.reset((RUNNING,))
+        todo = [p for p in products if self.ledger.state(p) != DONE]
+        total = len(todo)
+        print(f"Total: {len(products)} products, {total} to process, "
+              f"{self.slots} gpt processes in parallel")
+
+        self._number = 0
+        with ThreadPoolExecutor(max_workers=self.slots) as executor:
+            futures = [executor.submit(self._process, p, total) for p in todo]
+            try:
+                # 让主线程可以响应 Ctrl-C
+                while wait(futures, timeout=1).not_done:
+                    pass
+            except KeyboardInterrupt:
+                # 在退出 with 之前取消排队的任务, 否则 shutdown 会等它们全部运行完
+                print("\n\033[1;33mWARN: interrupted, stopping gpt processes...\033[0m")
+                self.stop()
+                executor.shutdown(cancel_futures=True)
+                raise
+        return self.ledger.counts()
+
+    def stop(self) -> None:
+        """kill running gpt processes, their jobs go back to `pending`"""
+        self._stop.set()
+        with self._lock:
+            for proc in self._procs:
+                proc.kill()
+
+    def _process(self, product: str, total: int) -> None:
+        with self._lock:
+            self._number += 1
+            print(f"[{self._number}/{total}] Processing {os.path.basename(product)}...")
+        log_path = self.output_path(product).removesuffix(".dim") + ".log"
+        for _ in range(self.max_times):
+            if self._stop.is_set():
+                return
+            self.ledger.set_state(product, RUNNING)
+            with open(log_path, 'w') as log:
+                proc = subprocess.Popen(self.command(product), stdout=log,
+                                        stderr=subprocess.STDOUT)
+                with self._lock:
+                    self._procs.add(proc)
+                code = proc.wait()
+                with self._lock:
+                    self._procs.discard(proc)
+
+            # Ctrl-C 也会发给 gpt 子进程, 它可能在 stop() 之前就退出了
+            if self._stop.is_set() or code == -signal.SIGINT:
+                self.ledger.set_state(product, PENDING)
+                return
+            if code == 0:
+                self.ledger.set_state(product, DONE, error=None)
+                return
+            self.ledger.set_state(product, FAILED,
+                                  error=f"gpt exited with {code}, see {log_path}")
+            print(f"\033[1;33mWARN: gpt failed on {os.path.basename(product)} "
+                  f"(exit {code})\033[0m")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='parallel SNAP gpt batch runner')
+    parser.add_argument('--graph', type=str, required=True, help="SNAP graph xml")
+    parser.add_argument('--products', type=str, required=True,
+                        help="folder of products (*.zip)")
+    parser.add_argument('--pattern', type=str, default="*.zip",
+                        help="glob pattern of products, e.g. '*T1006*.zip'")
+    parser.add_argument('--dest', type=str, required=True, help="destination folder")
+    parser.add_argument('--ledger', type=str, default=None,
+                        help="job ledger file, defaults to <dest>/gpt_ledger.json")
+    parser.add_argument('--gpt', type=str, default="gpt", help="gpt executable")
+    parser.add_argument('--max-memory', type=float, default=8,
+                        help="RAM budget for all gpt processes (GB)")
+    parser.add_argument('--max-cpus', type=int, default=os.cpu_count(),
+                        help="CPU budget for all gpt processes")
+    parser.add_argument('--job-memory', type=str, default="6G",
+                        help="RAM taken by one gpt process (its -Xmx)")
+    parser.add_argument('-q', '--threads', type=int, default=None,
+                        help="gpt -q option (parallelism of one process), "
+                             "defaults to max-cpus / number of processes")
+    parser.add_argument('-c', '--cache', type=str, default=None,
+                        help="gpt -c option (tile cache size, e.g. 4G)")
+    parser.add_argument('--max-times', type=int, default=2,
+                        help="maximum attempts of one product")
+    args = parser.parse_args()
+
+    products = sorted(glob.glob(os.path.join(args.products, args.pattern)))
+    slots = plan_slots(args.max_memory, args.max_cpus,
+                       parse_size(args.job_memory), args.threads or 1)
+    # 不指定 -q 时 gpt 会使用所有 CPU, 因此按进程数平分 CPU 预算
+    threads = args.threads or max(args.max_cpus // slots, 1)
+    runner = GptRunner(args.graph, args.dest, args.ledger, args.gpt, slots,
+                       threads, args.cache, args.max_times)
+    counts = runner.run(products)
+    if counts.get(DONE, 0) == len(runner.ledger.keys()):
+        print("All products are processed successfully!")
+    else:
+        print(f"Finished: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+### 检查无界面（headless）处理路径的导入耗时：在新的解释器中导入读取/裁剪/叠加模块，
+### 确认没有加载 matplotlib，且耗时不超过预算。超出预算时返回非零退出码，可用于批处理节点的检查。
+
+import sys
+import json
+import argparse
+import subprocess
+
+
+HEADLESS_MODULES = ("bandreader", "assamble2mat_npy_BEAMAP", "assamble2mat_npy_TIFF",
+                    "sentinel_crop", "gpt_runner", "bandplot")
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "matplotlib": "matplotlib" in sys.modules}}))
+"""
+
+
+def measure(modules: tuple = HEADLESS_MODULES, repeat: int = 3) -> dict:
+    """
+    Import `modules` in fresh interpreters
+
+    Return
+    ------
+        {"seconds": best import time of `repeat` runs,
+         "matplotlib": whether matplotlib got imported}
+    """
+    results = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(modules=tuple(modules))],
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return {"seconds": min(r["seconds"] for r in results),
+            "matplotlib": any(r["matplotlib"] for r in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import-time budget of the headless path')
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help="maximum import time (seconds)")
+    parser.add_argument('--repeat', type=int, default=3, help="number of measurements")
+    args = parser.parse_args()
+
+    res = measure(HEADLESS_MODULES, args.repeat)
+    print(f"import time: {res['seconds']:.3f}s (budget {args.budget:.3f}s), "
+          f"matplotlib loaded: {res['matplotlib']}")
+    if res["matplotlib"] or res["seconds"] > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
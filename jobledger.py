@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+
+
+PENDING     = "pending"
+RUNNING     = "running"
+DOWNLOADING = "downloading"
+OFFLINE     = "offline"     # LTA retrieval requested
+DONE        = "done"
+FAILED      = "failed"
+
+
+class JobLedger:
+    """
+    Persistent job ledger, a JSON file mapping job key -> job record
+
+    Every state change is flushed to disk (write to a temp file, then
+    `os.replace`), so a crashed run can be resumed by reopening the same file.
+
+    Parameters
+    ----------
+        - path : ledger file's path
+    """
+    def __init__(self, path: str) -> None:
+        self.path  = path
+        self.jobs  = {}
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            with open(path, 'r') as fr:
+                self.jobs = json.load(fr)
+
+    def add(self, key: str, **info) -> bool:
+        """
+        Register a job in `pending` state, jobs already in the ledger are kept
+
+        Return
+        ------
+            True if the job is new
+        """
+        with self._lock:
+            if key in self.jobs:
+                return False
+            self.jobs[key] = {"state": PENDING, "attempts": 0,
+                              "updated": time.time(), **info}
+            self._flush()
+            return True
+
+    def add_many(self, jobs: dict) -> list:
+        """
+        Register several jobs (`{key: info}`) with a single write, so the
+        ledger never holds only part of them, see `add`
+
+        Return
+        ------
+            keys of the new jobs
+        """
+        with self._lock:
+            now = time.time()
+            keys = [k for k in jobs if k not in self.jobs]
+            for k in keys:
+                self.jobs[k] = {"state": PENDING, "attempts": 0,
+                                "updated": now, **jobs[k]}
+            if keys:
+                self._flush()
+            return keys
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return dict(self.jobs[key])
+
+    def state(self, key: str) -> str:
+        with self._lock:
+            return self.jobs[key]["state"]
+
+    def set_state(self, key: str, state: str, **info) -> None:
+        """
+        Change the state of a job and store extra fields (e.g. `error`)
+        """
+        with self._lock:
+            job = self.jobs[key]
+            if state in (RUNNING, DOWNLOADING):
+                job["attempts"] += 1
+            job["state"] = state
+            job["updated"] = time.time()
+            job.update(info)
+            self._flush()
+
+    def keys(self, *states: str) -> list:
+        """
+        Job keys in insertion order, optionally only those in `states`
+        """
+        with self._lock:
+            return [k for k, v in self.jobs.items()
+                    if not states or v["state"] in states]
+
+    def reset(self, from_states: tuple, to_state: str = PENDING) -> list:
+        """
+        Move every job in `from_states` to `to_state`, used on restart to
+        requeue jobs that were interrupted
+
+        Return
+        ------
+            keys of the moved jobs
+        """
+        with self._lock:
+            keys = self.keys(*from_states)
+            for k in keys:
+                self.jobs[k]["state"] = to_state
+                self.jobs[k]["updated"] = time.time()
+            if keys:
+                self._flush()
+            return keys
+
+    def counts(self) -> dict:
+        """number of jobs in each state"""
+        with self._lock:
+            res = {}
+            for v in self.jobs.values():
+                res[v["state"]] = res.get(v["state"], 0) + 1
+            return res
+
+    def _flush(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as fw:
+            json.dump(self.jobs, fw, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,166 @@
+### 下载调度的压测：在本地 MockDataHub 上按不同的故障配置运行 downloader_new.check（包括子进程重启），
+### 统计每小时下载的产品数、吞吐量和故障恢复时间，并检查下载结果的 MD5。
+### 用法示例：
+###     python loadtest.py --profiles clean lta quota checksum flaky --products 20 --size 4M \
+###         --workers 4 --segments 4 --kill-after 5
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from multiprocessing import Lock
+from footprint_coverage import size_to_bytes
+from mockhub import FAULT_PROFILES, DEFAULT_FOOTPRINT, FaultProfile, MockDataHub, make_products
+from downloader_new import UserParameter, check
+
+
+def _md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fr:
+        for chunk in iter(lambda: fr.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def run_profile(name: str, profile: FaultProfile, work_dir: str, products: int = 20,
+                size: int = 4 << 20, workers: int = 4, segments: int = 4,
+                lta_quota: int = 20, kill_after: float = None,
+                timeout: float = 600) -> dict:
+    """
+    Download all products of a mock hub with `downloader_new.check`
+
+    Parameters
+    ----------
+        - name : profile name, the products are saved to `<work_dir>/<name>`
+        - profile : faults injected by the hub
+        - products, size : number and size (bytes) of the mock products
+        - workers, segments, lta_quota : download parameters
+        - kill_after : kill the download process after this many seconds,
+                       to measure the respawn
+        - timeout : give up after this many seconds
+
+    Return
+    ------
+        dict of results: products/hour, MB/s, recovery times (seconds from
+        the first fault injected into a product to its download finishing,
+        and from the kill to the next finished product), hub fault counters
+    """
+    save_path = os.path.join(work_dir, name)
+    if os.path.exists(save_path):
+        shutil.rmtree(save_path)
+    os.makedirs(save_path)
+    mock_products = make_products(products, size)
+    hub = MockDataHub(mock_products, profile).start()
+    params = UserParameter(
+                "mock", "mock", DEFAULT_FOOTPRINT,
+                ("20200101", "NOW"),
+                'Sentinel-1', 'GRD', 'ASCENDING',
+                api_url=hub.api_url,
+                save_path=save_path,
+                workers=workers,
+                segments=segments,
+                lta_quota=lta_quota,
+                lta_poll=max(profile.lta_delay / 4, 1),
+                metrics_path=os.path.join(save_path, "metrics")
+            )
+
+    started, killed = time.time(), None
+    stop = threading.Event()
+    supervisor = threading.Thread(target=check, args=(Lock(), params, stop), daemon=True)
+    supervisor.start()
+    if kill_after:
+        supervisor.join(kill_after)
+        if supervisor.is_alive():
+            killed = time.time()
+            for p in multiprocessing.active_children():
+                p.kill()
+    supervisor.join(max(timeout - (time.time() - started), 0))
+    elapsed = time.time() - started
+    timed_out = supervisor.is_alive()
+    if timed_out:
+        # 先停止 check(), 否则它会继续重启下载进程, 影响后面的测试
+        stop.set()
+        supervisor.join()
+    hub.stop()
+
+    records = {}
+    if os.path.exists(params.metrics_path + ".jsonl"):
+        with open(params.metrics_path + ".jsonl", 'r') as fr:
+            for line in fr:
+                record = json.loads(line)
+                records[record["id"]] = record     # 重启后的记录覆盖之前的
+    valid = sum(1 for p in mock_products
+                if os.path.exists(os.path.join(save_path, p.title + ".zip"))
+                and _md5(os.path.join(save_path, p.title + ".zip")) == p.md5)
+    finished = {pid: r["finished"] for pid, r in records.items() if r["status"] == "done"}
+    recovery = [finished[pid] - t for pid, t in hub.faults.items() if pid in finished]
+    after_kill = [t - killed for t in finished.values() if killed and t > killed]
+    return {
+        "profile": name,
+        "products": products,
+        "valid": valid,
+        "failed": sum(1 for r in records.values() if r["status"] != "done"),
+        "elapsed": elapsed,
+        "timed_out": timed_out,
+        "products_per_hour": valid / elapsed * 3600,
+        "throughput": valid * size / elapsed,
+        "faulted": len(hub.faults),
+        "recovery_mean": sum(recovery) / len(recovery) if recovery else None,
+        "recovery_max": max(recovery) if recovery else None,
+        "respawn_recovery": min(after_kill) if after_kill else None,
+        "hub": dict(hub.stats),
+    }
+
+
+def _seconds(value) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test of the download scheduler on a mock DataHub')
+    parser.add_argument('--profiles', type=str, nargs='+', default=list(FAULT_PROFILES),
+                        choices=list(FAULT_PROFILES), help="fault profiles to run")
+    parser.add_argument('--products', type=int, default=20, help="number of mock products")
+    parser.add_argument('--size', type=str, default="4M", help="size of every product, e.g. 4M")
+    parser.add_argument('--workers', type=int, default=4, help="products downloaded concurrently")
+    parser.add_argument('--segments', type=int, default=4,
+                        help="range segments per product, 0 for SentinelAPI.download")
+    parser.add_argument('--lta-quota', type=int, default=20, help="LTA requests in flight")
+    parser.add_argument('--kill-after', type=float, default=None,
+                        help="kill the download process after this many seconds")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds per profile")
+    parser.add_argument('--work-dir', type=str, default=os.path.join("tmp", "loadtest"),
+                        help="folder of the downloaded products, removed afterwards")
+    parser.add_argument('--keep', action='store_true', help="keep the downloaded products")
+    parser.add_argument('--output', type=str, default=None, help="save the results as json")
+    args = parser.parse_args()
+
+    size = size_to_bytes(args.size if args.size.upper().endswith("B") else args.size + "B")
+    results = []
+    for name in args.profiles:
+        print(f"\n===== profile '{name}': {FAULT_PROFILES[name]} =====")
+        results.append(run_profile(name, FaultProfile(**FAULT_PROFILES[name]), args.work_dir,
+                                   args.products, size, args.workers, args.segments,
+                                   args.lta_quota, args.kill_after, args.timeout))
+    if not args.keep:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    print(f"\n{'profile':<10}{'valid':>8}{'time(s)':>9}{'products/h':>12}{'MB/s':>8}"
+          f"{'faulted':>9}{'recovery mean/max(s)':>22}{'respawn(s)':>12}")
+    for r in results:
+        recovery = f"{_seconds(r['recovery_mean'])}/{_seconds(r['recovery_max'])}"
+        print(f"{r['profile']:<10}{r['valid']:>4}/{r['products']:<3}{r['elapsed']:>9.1f}"
+              f"{r['products_per_hour']:>12.0f}{r['throughput'] / 1024 ** 2:>8.2f}"
+              f"{r['faulted']:>9}{recovery:>22}{_seconds(r['respawn_recovery']):>12}"
+              + ("  TIMEOUT" if r['timed_out'] else ""))
+    if args.output:
+        with open(args.output, 'w') as fw:
+            json.dump(results, fw, indent=2)
+
+
+if __name__ == "__main__":
+    main()
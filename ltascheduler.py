@@ -0,0 +1,247 @@
+import time
+import heapq
+import random
+from collections import deque
+from multiprocessing import Lock, Value
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sentinelsat import SentinelAPI
+from sentinelsat.exceptions import LTAError, ServerError
+from jobledger import JobLedger, PENDING, DOWNLOADING, OFFLINE, DONE, FAILED
+from dlmetrics import DownloadMetrics
+
+
+class LTAScheduler:
+    """
+    Download online products while offline (LTA) products are being retrieved
+
+    Online products go straight to a pool of download threads. Offline ones
+    get an LTA retrieval request as long as the per-user quota allows, then
+    their availability is polled with exponential backoff and jitter, and
+    each one is downloaded as soon as it comes online.
+
+    Parameters
+    ----------
+        - api : SentinelAPI
+        - download_fn : callable(product_id) -> int, returns the codes of
+                        `downloader_new.download_data` (0, -1, -2, -3)
+        - lock : multiprocessing.Lock guarding `total` and `remain`
+        - total : total of product queried
+        - remain : remain of products
+        - workers : number of products downloaded concurrently
+        - quota : maximum LTA requests in flight for the user
+        - max_times : maximum download attempts of one product
+        - base_delay : first polling interval of a requested product (seconds)
+        - max_delay : longest polling interval (seconds)
+        - jitter : relative random spread of every polling interval
+        - max_wait : seconds a requested product may stay offline; after it
+                     the retrieval is requested once more, and when that
+                     times out too the product fails and frees its quota slot
+        - ledger : record the state of every product in this job ledger
+        - metrics : record LTA wait times and finished products
+    """
+    def __init__(self, api: SentinelAPI, download_fn, lock: Lock, total: Value,
+                 remain: Value, workers: int = 1, quota: int = 20,
+                 max_times: int = 3, base_delay: float = 60,
+                 max_delay: float = 60 * 30, jitter: float = 0.5,
+                 max_wait: float = 60 * 60 * 24,
+                 ledger: JobLedger = None, metrics: DownloadMetrics = None) -> None:
+        self.api         = api
+        self.download_fn = download_fn
+        self.lock        = lock
+        self.total       = total
+        self.remain      = remain
+        self.workers     = workers
+        self.quota       = quota
+        self.max_times   = max_times
+        self.base_delay  = base_delay
+        self.max_delay   = max_delay
+        self.jitter      = jitter
+        self.max_wait    = max_wait
+        self.ledger      = ledger
+        self.metrics     = metrics
+        self.requested   = set()     # 已提交 LTA 请求、等待上线的产品
+        self.waiting     = deque()   # 等待 LTA 配额的离线产品
+        self.failed      = []
+        self._polls      = []        # (下次检查时间, 产品ID, 当前间隔)
+        self._attempts   = {}
+        self._deadline   = {}        # 产品ID -> 等待上线的截止时间
+        self._retried    = set()     # 已重新提交过 LTA 请求的产品
+        self._quota_free = 0         # LTAError 后, 最早重新提交请求的时间
+        self._quota_wait = base_delay
+
+    def run(self, product_ids: list, requested: list = (),
+            finished: int = 0) -> list:
+        """
+        Download all products
+
+        Parameters
+        ----------
+            - product_ids : products to download
+            - requested : offline products whose LTA retrieval was already
+                          requested (e.g. by a previous run), they are polled
+                          right away instead of being requested again
+            - finished : products already downloaded by a previous run,
+                         only counted in `total`
+
+        Return
+        ------
+            IDs of products that could not be downloaded
+        """
+        with self.lock:
+            self.total.value = len(product_ids) + len(requested) + finished
+            self.remain.value = len(product_ids) + len(requested)
+        print("Total: {} products".format(self.total.value))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self._executor = executor
+            self._futures = {}
+            for pid in requested:
+                self.requested.add(pid)
+                self._deadline[pid] = time.time() + self.max_wait
+                heapq.heappush(self._polls, (time.time(), pid, self.base_delay))
+            for pid in product_ids:
+                if self._is_online(pid):
+                    self._submit(pid)
+                else:
+                    self.waiting.append(pid)
+            self._request_waiting()
+
+            while self._futures or self._polls or self.waiting:
+                # 等待下载完成、下一次轮询或配额重试, 以先到者为准
+                timeout = max(self._next_event() - time.time(), 0)
+                if self._futures:
+                    done, _ = wait(list(self._futures), timeout=timeout,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(self._futures.pop(future), future.result())
+                else:
+                    time.sleep(timeout)
+                self._poll_due()
+                self._request_waiting()
+        return self.failed
+
+    def _next_event(self) -> float:
+        """time of the next LTA poll or quota retry"""
+        times = []
+        if self._polls:
+            times.append(self._polls[0][0])
+        if self.waiting and len(self.requested) < self.quota:
+            times.append(max(self._quota_free, time.time()))
+        return min(times) if times else time.time() + 60
+
+    def _mark(self, pid: str, state: str) -> None:
+        if self.ledger:
+            self.ledger.set_state(pid, state)
+
+    def _submit(self, pid: str) -> None:
+        self._futures[self._executor.submit(self._download, pid)] = pid
+
+    def _download(self, pid: str) -> int:
+        self._mark(pid, DOWNLOADING)
+        return self.download_fn(pid)
+
+    def _finish(self, pid: str, res: int) -> None:
+        if res == 0:
+            self._mark(pid, DONE)
+            if self.metrics:
+                self.metrics.finish(pid, DONE)
+            with self.lock:
+                self.remain.value -= 1
+                number = self.total.value - self.remain.value
+            print(f'[{number}/{self.total.value}] {pid} downloaded')
+            return
+        if res in (-1, -3):
+            # 产品在下载前又转为离线
+            self._mark(pid, PENDING)
+            if self.metrics and res == -1:
+                self.metrics.lta_requested(pid)
+            self.waiting.append(pid)
+            return
+        self._attempts[pid] = self._attempts.get(pid, 0) + 1
+        if self._attempts[pid] < self.max_times:
+            self._submit(pid)
+        else:
+            print(f"\033[1;33mWARN: failed to download {pid}\033[0m")
+            self._mark(pid, FAILED)
+            if self.metrics:
+                self.metrics.finish(pid, FAILED)
+            self.failed.append(pid)
+
+    def _request_waiting(self) -> None:
+        """submit LTA requests for waiting products while quota is left"""
+        while self.waiting and len(self.requested) < self.quota \
+                and time.time() >= self._quota_free:
+            pid = self.waiting[0]
+            try:
+                triggered = self.api.trigger_offline_retrieval(pid)
+            except (LTAError, ServerError):
+                # 配额被其他会话占用或服务器繁忙, 等到下一个产品上线或退避后重试
+                self._quota_free = time.time() + self._delay(self._quota_wait)
+                self._quota_wait = min(self._quota_wait * 2, self.max_delay)
+                print(f"LTA request refused with {len(self.requested)} requests, "
+                      f"retry at {time.strftime('%H:%M:%S', time.localtime(self._quota_free))}")
+                return
+            self._quota_wait = self.base_delay
+            self.waiting.popleft()
+            if not triggered:
+                self._submit(pid)
+                continue
+            print(f"LTA retrieval requested for {pid} "
+                  f"({len(self.requested) + 1}/{self.quota})")
+            self._mark(pid, OFFLINE)
+            if self.metrics:
+                self.metrics.lta_requested(pid)
+            self.requested.add(pid)
+            self._deadline[pid] = time.time() + self.max_wait
+            self._schedule(pid, self.base_delay)
+
+    def _poll_due(self) -> None:
+        now = time.time()
+        while self._polls and self._polls[0][0] <= now:
+            _, pid, delay = heapq.heappop(self._polls)
+            if self._is_online(pid):
+                if self.metrics:
+                    self.metrics.lta_online(pid)
+                self.requested.discard(pid)
+                self._quota_free = 0
+                self._submit(pid)
+            elif now >= self._deadline[pid]:
+                self._expire(pid)
+            else:
+                self._schedule(pid, min(delay * 2, self.max_delay))
+
+    def _expire(self, pid: str) -> None:
+        """a requested product did not come online within `max_wait`"""
+        if pid not in self._retried:
+            self._retried.add(pid)
+            print(f"\033[1;33mWARN: {pid} is still offline, requesting it again\033[0m")
+            try:
+                if not self.api.trigger_offline_retrieval(pid):
+                    self.requested.discard(pid)
+                    self._quota_free = 0
+                    self._submit(pid)
+                    return
+            except (LTAError, ServerError):
+                pass
+            self._deadline[pid] = time.time() + self.max_wait
+            self._schedule(pid, self.base_delay)
+            return
+        print(f"\033[1;33mWARN: {pid} did not come online, giving up\033[0m")
+        self.requested.discard(pid)
+        self._quota_free = 0
+        self._mark(pid, FAILED)
+        if self.metrics:
+            self.metrics.finish(pid, FAILED)
+        self.failed.append(pid)
+
+    def _schedule(self, pid: str, delay: float) -> None:
+        heapq.heappush(self._polls, (time.time() + self._delay(delay), pid, delay))
+
+    def _delay(self, delay: float) -> float:
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _is_online(self, pid: str) -> bool:
+        try:
+            return self.api.is_online(pid)
+        except ServerError:
+            return False
@@ -0,0 +1,475 @@
+### 本地模拟的 DataHub：实现 SentinelAPI 用到的 OpenSearch 查询接口和 OData 产品信息/下载接口，
+### 用于在没有哥白尼账户的情况下测试 downloader_new 的重试、LTA 和子进程重启逻辑（压测见 loadtest.py）。
+### 可以注入离线 (LTA) 产品、LTA 配额错误、校验失败、断线、服务器错误、延迟和带宽限制。
+### 用法示例：
+###     python mockhub.py --products 20 --size 4M --profile lta --port 8000
+###     然后把 UserParameter 的 api_url 设为 http://127.0.0.1:8000/ （用户名和密码任意）
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from footprint_coverage import size_to_bytes
+
+
+# 故障配置，参数见 FaultProfile
+FAULT_PROFILES = {
+    "clean": {},
+    "lta": {"offline": 0.5, "lta_delay": 10},
+    "quota": {"offline": 0.8, "lta_delay": 10, "lta_quota": 2, "lta_unavailable": 0.1},
+    "checksum": {"corrupt": 0.3},
+    "flaky": {"drop": 0.2, "error": 0.05, "latency": 0.2},
+    "slow": {"bandwidth": 2 << 20, "max_flows": 4, "latency": 0.5},
+}
+
+DEFAULT_FOOTPRINT = "POLYGON((115.5 42.0,117.0 42.0,117.0 43.2,115.5 43.2,115.5 42.0))"
+
+
+class FaultProfile:
+    """
+    Faults injected by `MockDataHub`
+
+    Parameters
+    ----------
+        - offline : part of the products that are in the LTA (offline)
+        - lta_delay : seconds from an accepted LTA request to the product
+                      being online
+        - lta_quota : maximum LTA retrievals in flight, further requests get
+                      403 'offline products retrieval quota exceeded'
+        - lta_unavailable : probability of 503 on an LTA request
+        - corrupt : part of the products whose first complete download is
+                    corrupted (MD5 mismatch)
+        - drop : probability of a download connection dropped halfway
+        - error : probability of 500 on any request
+        - latency : seconds added before every response
+        - bandwidth : bytes/s of every download connection, 0 for no limit
+        - max_flows : maximum concurrent downloads, further ones get 403
+                      'concurrent flows', 0 for no limit
+        - seed : random seed
+    """
+    def __init__(self, offline: float = 0, lta_delay: float = 30, lta_quota: int = 20,
+                 lta_unavailable: float = 0, corrupt: float = 0, drop: float = 0,
+                 error: float = 0, latency: float = 0, bandwidth: int = 0,
+                 max_flows: int = 0, seed: int = 0) -> None:
+        self.offline         = offline
+        self.lta_delay       = lta_delay
+        self.lta_quota       = lta_quota
+        self.lta_unavailable = lta_unavailable
+        self.corrupt         = corrupt
+        self.drop            = drop
+        self.error           = error
+        self.latency         = latency
+        self.bandwidth       = bandwidth
+        self.max_flows       = max_flows
+        self.seed            = seed
+
+
+class MockProduct:
+    """
+    A product of the mock hub, its content is `size` random bytes
+
+    Parameters
+    ----------
+        - pid : product UUID
+        - title : product title, e.g. 'S1A_IW_GRDH_1SDV_20210106T...'
+        - begin : sensing start (UTC)
+        - size : bytes of the product zip
+        - footprint : WKT footprint
+        - attrs : other OpenSearch attributes (platformname, producttype, ...)
+    """
+    def __init__(self, pid: str, title: str, begin: datetime, size: int,
+                 footprint: str = DEFAULT_FOOTPRINT, **attrs) -> None:
+        self.pid       = pid
+        self.title     = title
+        self.begin     = begin
+        self.size      = size
+        self.footprint = footprint
+        self.attrs     = attrs
+        self.data      = random.Random(pid).randbytes(size)
+        self.md5       = hashlib.md5(self.data).hexdigest()
+        self.online    = True
+        self.online_at = None    # LTA 请求被接受后的上线时间
+        self.corrupt   = 0       # 还要损坏的完整下载次数
+
+
+def make_products(n: int, size: int, start: str = "20210101", every: int = 12,
+                  footprint: str = DEFAULT_FOOTPRINT, product_type: str = "GRD",
+                  orbit_direction: str = "ASCENDING") -> list:
+    """
+    `n` Sentinel-1 products acquired every `every` days from `start`
+    """
+    products = []
+    t0 = datetime.strptime(start, "%Y%m%d").replace(hour=10, minute=52, second=17)
+    for i in range(n):
+        begin = t0 + timedelta(days=every * i)
+        end = begin + timedelta(seconds=25)
+        orbit = 35000 + 175 * i
+        pid = "{:08x}-0000-4000-8000-{:012x}".format(0x5e471e1, i)
+        title = (f"S1A_IW_{product_type}H_1SDV_{begin:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}"
+                 f"_{orbit:06d}_{orbit * 7 & 0xffffff:06X}_{i & 0xffff:04X}")
+        products.append(MockProduct(pid, title, begin, size, footprint,
+                                    platformname="Sentinel-1", producttype=product_type,
+                                    orbitdirection=orbit_direction.upper()))
+    return products
+
+
+class MockDataHub:
+    """
+    Local stand-in for the Copernicus DataHub, serving the endpoints used by
+    `SentinelAPI`:
+
+        /search?q=...&rows=...&start=...               OpenSearch query
+        /odata/v1/Products('<id>')?$format=json        product metadata
+        /odata/v1/Products('<id>')/Online/$value       online flag
+        /odata/v1/Products('<id>')/$value              download (Range) or
+                                                       LTA request (202/403/503)
+        /odata/v1/Products('<id>')/Attributes('Filename')/Value/$value
+
+    Any user name and password are accepted.
+
+    Parameters
+    ----------
+        - products : MockProduct list, e.g. from `make_products`
+        - profile : FaultProfile
+        - host, port : address to listen on, port 0 picks a free port
+    """
+    def __init__(self, products: list, profile: FaultProfile = None,
+                 host: str = "127.0.0.1", port: int = 0) -> None:
+        self.profile  = profile or FaultProfile()
+        self.products = {p.pid: p for p in products}
+        self.rng      = random.Random(self.profile.seed)
+        self.faults   = {}     # 产品ID -> 第一次注入故障的时间
+        self.stats    = {"requests": 0, "bytes": 0, "downloads": 0, "lta_accepted": 0,
+                         "quota_errors": 0, "unavailable": 0, "flow_errors": 0,
+                         "corrupted": 0, "dropped": 0, "errors": 0}
+        self.flows    = 0
+        self._lock    = threading.Lock()
+        for p in products:
+            if self.rng.random() < self.profile.offline:
+                p.online = False
+            if self.rng.random() < self.profile.corrupt:
+                p.corrupt = 1
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "MockDataHub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def is_online(self, product: MockProduct) -> bool:
+        if not product.online and product.online_at and time.time() >= product.online_at:
+            product.online = True
+        return product.online
+
+    def _fault(self, pid: str, kind: str) -> None:
+        with self._lock:
+            self.stats[kind] += 1
+            if pid:
+                self.faults.setdefault(pid, time.time())
+
+    def _chance(self, p: float) -> bool:
+        with self._lock:
+            return p > 0 and self.rng.random() < p
+
+    def _retrievals(self) -> int:
+        """LTA retrievals in flight"""
+        return sum(1 for p in self.products.values()
+                   if not self.is_online(p) and p.online_at)
+
+
+def _gml(wkt: str) -> str:
+    """WKT polygon -> GML as served by DHuS (lat,lon pairs)"""
+    points = re.search(r"\(\(\s*([^()]+?)\s*\)", wkt).group(1).split(",")
+    coords = " ".join(",".join(point.split()[::-1]) for point in points)
+    return ('<gml:Polygon srsName="http://www.opengis.net/gml/srs/epsg.xml#4326" '
+            'xmlns:gml="http://www.opengis.net/gml"><gml:outerBoundaryIs><gml:LinearRing>'
+            f'<gml:coordinates>{coords}</gml:coordinates>'
+            '</gml:LinearRing></gml:outerBoundaryIs></gml:Polygon>')
+
+
+def _odata_date(t: datetime) -> str:
+    return "/Date({})/".format(int(t.replace(tzinfo=timezone.utc).timestamp() * 1000))
+
+
+def _iso(t: datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-4] + "Z"
+
+
+def _parse_date(value: str) -> datetime:
+    value = value.strip('"')
+    if value.startswith("NOW"):
+        return datetime.utcnow()
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def _handler(hub: MockDataHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self._route(head=True)
+
+        def do_GET(self):
+            self._route(head=False)
+
+        def _route(self, head: bool) -> None:
+            try:
+                self._dispatch(head)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端断开 (例如下载进程被重启)
+                self.close_connection = True
+
+        def _dispatch(self, head: bool) -> None:
+            with hub._lock:
+                hub.stats["requests"] += 1
+            if hub.profile.latency:
+                time.sleep(hub.profile.latency)
+            url = urlsplit(self.path)
+            m = re.match(r"^/odata/v1/Products\('([^']+)'\)(.*)$", url.path)
+            pid = m.group(1) if m else None
+            if hub._chance(hub.profile.error):
+                hub._fault(pid, "errors")
+                return self._send(500, b"Internal Server Error", "text/plain",
+                                  {"cause-message": "Mock DataHub injected error"})
+            if url.path.rstrip("/") == "/search":
+                return self._search(parse_qs(url.query))
+            if not m or pid not in hub.products:
+                return self._send(404, json.dumps({"error": {"code": None, "message": {
+                    "lang": "en", "value": f"Invalid key ({pid}) to access Products"}}}).encode())
+            product, rest = hub.products[pid], m.group(2)
+            if rest == "":
+                return self._metadata(product)
+            if rest == "/Online/$value":
+                return self._send(200, json.dumps(hub.is_online(product)).encode())
+            if rest == "/Attributes('Filename')/Value/$value":
+                return self._send(200, (product.title + ".SAFE").encode(), "text/plain")
+            if rest == "/$value":
+                return self._value(product, head)
+            return self._send(404, b"Not Found", "text/plain")
+
+        def _send(self, code: int, body: bytes, ctype: str = "application/json",
+                  headers: dict = None) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _search(self, query: dict) -> None:
+            q = query.get("q", [""])[0]
+            rows = int(query.get("rows", ["100"])[0])
+            start = int(query.get("start", ["0"])[0])
+            products = list(hub.products.values())
+            m = re.search(r"beginPosition:\[(\S+) TO (\S+)\]", q)
+            if m:
+                t0, t1 = _parse_date(m.group(1)), _parse_date(m.group(2))
+                products = [p for p in products if t0 <= p.begin <= t1]
+            for key, value in re.findall(r"(\w+):\"([^\"]*)\"", q):
+                key = key.lower()
+                if key != "footprint":
+                    products = [p for p in products
+                                if str(p.attrs.get(key, value)).lower() == value.lower()]
+            products.sort(key=lambda p: p.begin)
+            host = self.headers.get("Host")
+            entries = [{
+                "id": p.pid,
+                "title": p.title,
+                "link": [{"href": f"http://{host}/odata/v1/Products('{p.pid}')/$value"},
+                         {"rel": "alternative", "href": f"http://{host}/odata/v1/Products('{p.pid}')/"}],
+                "summary": f"Date: {_iso(p.begin)}, Size: {p.size / 1024 ** 2:.2f} MB",
+                "date": [{"name": "beginposition", "content": _iso(p.begin)},
+                         {"name": "endposition", "content": _iso(p.begin + timedelta(seconds=25))},
+                         {"name": "ingestiondate", "content": _iso(p.begin + timedelta(hours=3))}],
+                "str": [{"name": "title", "content": p.title},
+                        {"name": "identifier", "content": p.title},
+                        {"name": "uuid", "content": p.pid},
+                        {"name": "footprint", "content": p.footprint},
+                        {"name": "size", "content": f"{p.size / 1024 ** 2:.2f} MB"}]
+                       + [{"name": k, "content": str(v)} for k, v in p.attrs.items()],
+            } for p in products[start:start + rows]]
+            feed = {"opensearch:totalResults": str(len(products)),
+                    "opensearch:startIndex": str(start),
+                    "opensearch:itemsPerPage": str(rows),
+                    "entry": entries}
+            self._send(200, json.dumps({"feed": feed}).encode())
+
+        def _metadata(self, product: MockProduct) -> None:
+            host = self.headers.get("Host")
+            d = {
+                "__metadata": {"media_src": f"http://{host}/odata/v1/Products('{product.pid}')/$value"},
+                "Id": product.pid,
+                "Name": product.title,
+                "ContentLength": str(product.size),
+                "Checksum": {"Algorithm": "MD5", "Value": product.md5.upper()},
+                "ContentDate": {"Start": _odata_date(product.begin),
+                                "End": _odata_date(product.begin + timedelta(seconds=25))},
+                "ContentGeometry": _gml(product.footprint),
+                "CreationDate": _odata_date(product.begin + timedelta(hours=3)),
+                "IngestionDate": _odata_date(product.begin + timedelta(hours=3)),
+                "Online": hub.is_online(product),
+                "Attributes": {"__deferred": {}},
+            }
+            self._send(200, json.dumps({"d": d}).encode())
+
+        def _value(self, product: MockProduct, head: bool) -> None:
+            profile = hub.profile
+            if not hub.is_online(product):
+                # 离线产品：下载请求即 LTA 请求
+                with hub._lock:
+                    accepted = product.online_at is not None
+                    quota_full = not accepted and hub._retrievals() >= profile.lta_quota
+                    if not accepted and not quota_full:
+                        unavailable = hub.rng.random() < profile.lta_unavailable
+                        if not unavailable:
+                            product.online_at = time.time() + profile.lta_delay
+                            hub.stats["lta_accepted"] += 1
+                            hub.faults.setdefault(product.pid, time.time())
+                if quota_full:
+                    hub._fault(product.pid, "quota_errors")
+                    return self._send(403, b"", headers={"cause-message":
+                        "User 'mock' offline products retrieval quota exceeded "
+                        f"({profile.lta_quota} fetches max) trying to fetch product "
+                        f"{product.title} ({product.size} bytes compressed)"})
+                if not accepted and unavailable:
+                    hub._fault(product.pid, "unavailable")
+                    return self._send(503, b"", headers={"cause-message":
+                        "Service temporarily unavailable, retry later"})
+                return self._send(202, b"", headers={"cause-message":
+                    f"Product {product.title} is being retrieved from the Long Term Archive"})
+
+            start, stop = 0, product.size - 1
+            m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if m:
+                start = int(m.group(1))
+                stop = min(int(m.group(2)), stop) if m.group(2) else stop
+                if start > stop:
+                    return self._send(416, b"", headers={"Content-Range": f"bytes */{product.size}"})
+            headers = {"Accept-Ranges": "bytes",
+                       "Content-Disposition": f'attachment; filename="{product.title}.zip"'}
+            if m:
+                headers["Content-Range"] = f"bytes {start}-{stop}/{product.size}"
+            if head:
+                return self._head(206 if m else 200, stop - start + 1, headers)
+
+            with hub._lock:
+                if profile.max_flows and hub.flows >= profile.max_flows:
+                    flows_full = True
+                else:
+                    flows_full = False
+                    hub.flows += 1
+            if flows_full:
+                hub._fault(product.pid, "flow_errors")
+                return self._send(403, b"", headers={"cause-message":
+                    "An exception occured while creating a stream: Maximum number of "
+                    f"{profile.max_flows} concurrent flows achieved by the user \"mock\""})
+            try:
+                self._stream(product, start, stop, 206 if m else 200, headers)
+            finally:
+                with hub._lock:
+                    hub.flows -= 1
+
+        def _head(self, code: int, length: int, headers: dict) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+
+        def _stream(self, product: MockProduct, start: int, stop: int, code: int,
+                    headers: dict) -> None:
+            profile = hub.profile
+            body = product.data[start:stop + 1]
+            # 损坏的字节放在产品中间, 分段下载时也只有一个分段受影响
+            bad = product.size // 2
+            corrupt = product.corrupt > 0 and start <= bad <= stop and len(body) > 2
+            if corrupt:
+                body = bytearray(body)
+                body[bad - start] ^= 0xff
+            cut = len(body) // 2 if len(body) > 1 << 16 and hub._chance(profile.drop) else None
+
+            self._head(code, len(body), headers)
+            chunk = 1 << 16
+            started, sent = time.time(), 0
+            end = cut if cut is not None else len(body)
+            try:
+                while sent < end:
+                    n = min(chunk, end - sent)
+                    self.wfile.write(body[sent:sent + n])
+                    sent += n
+                    if profile.bandwidth:
+                        ahead = sent / profile.bandwidth - (time.time() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+            finally:
+                with hub._lock:
+                    hub.stats["bytes"] += sent
+            if cut is not None:
+                hub._fault(product.pid, "dropped")
+                self.close_connection = True
+                return
+            with hub._lock:
+                hub.stats["downloads"] += 1
+                if corrupt and product.corrupt > 0:
+                    product.corrupt -= 1
+                    hub.stats["corrupted"] += 1
+                    hub.faults.setdefault(product.pid, time.time())
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local mock of the Copernicus DataHub')
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--products', type=int, default=20, help="number of products")
+    parser.add_argument('--size', type=str, default="4M", help="size of every product, e.g. 4M")
+    parser.add_argument('--profile', type=str, default="clean", choices=list(FAULT_PROFILES),
+                        help="fault profile")
+    args = parser.parse_args()
+
+    size = args.size if args.size.upper().endswith("B") else args.size + "B"
+    products = make_products(args.products, size_to_bytes(size))
+    hub = MockDataHub(products, FaultProfile(**FAULT_PROFILES[args.profile]),
+                      args.host, args.port)
+    print(f"Mock DataHub ({args.profile}) listening on {hub.api_url}, "
+          f"{sum(not p.online for p in products)}/{len(products)} products offline")
+    try:
+        hub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
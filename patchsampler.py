@@ -0,0 +1,299 @@
+### 训练数据的 patch 采样：从叠加好的 {zone}_vv_/vh_{size}x{size}.npy（或 *.data 时间序列）中
+### 随机或按网格截取 (时间, y, x) patch，VV/VH 成对返回，后台线程预取 batch。
+### 数据以 memmap 方式打开（或放入 multiprocessing.shared_memory），多个 data-loader 进程共享一份内存。
+### 用法示例（测试吞吐量）：
+###     python patchsampler.py --stack Subsets/lake1/matrix --zone sanggendalailake1 --size 400 \
+###         --patch 4 64 64 --batch 32 --batches 200 --threads 2
+
+import os
+import time
+import argparse
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+from bandreader import Band
+from profiling import stage, enable
+
+
+def open_stack(save_path: str, zonename: str, size: int, ztime: int = None) -> tuple:
+    """
+    memmap the VV/VH stacks saved by `ZoneStack.save()` or
+    `assamble2mat_npy_BEAMAP.run()`
+
+    Parameters
+    ----------
+        - save_path : folder of the stacks
+        - zonename : zone name
+        - size : stacks are `<zonename>_vv_<size>x<size>.npy`
+        - ztime : zone time of `assamble2mat_npy_BEAMAP` (`..._t<ztime>.npy`)
+
+    Return
+    ------
+        (vv, vh) read-only memmaps of shape (T, size, size)
+    """
+    suffix = f"_t{ztime}" if ztime is not None else ""
+    return tuple(np.load(os.path.join(save_path, f"{zonename}_{pol}_{size}x{size}{suffix}.npy"),
+                         mmap_mode='r') for pol in ("vv", "vh"))
+
+
+def open_data(fpath: str, bands: tuple = ("Intensity_VV", "Intensity_VH"),
+              bbox: tuple = None, geojson: str = None) -> tuple:
+    """
+    memmap the bands of every `*.data` folder of `fpath` as a time series,
+    ordered like `assamble2mat_npy_BEAMAP` (by acquisition date)
+
+    Return
+    ------
+        (vv, vh) lists of 2-D memmaps, one per acquisition
+    """
+    dirs = sorted((x for x in os.listdir(fpath) if x.endswith('.data')),
+                  key=lambda x: x[24:32])
+    return tuple([Band(os.path.join(fpath, d), band, bbox, geojson, lazy=True).radar_pixels
+                  for d in dirs] for band in bands)
+
+
+class SharedStack:
+    """
+    VV/VH stacks copied once into `multiprocessing.shared_memory`
+
+    Pickling a SharedStack (e.g. passing it to data-loader worker processes)
+    only sends the block name, the workers attach to the same memory.
+    Memmaps of `.npy` stacks are already shared through the page
+    cache; this is for sources that have to be converted first, e.g. the
+    big-endian `.data` bands.
+
+    Parameters
+    ----------
+        - vv, vh : (T, H, W) arrays or lists of 2-D arrays
+        - dtype : stored data type
+    """
+    def __init__(self, vv=None, vh=None, dtype: str = "float32") -> None:
+        self.shm   = None
+        self.owner = None                # 创建共享内存的进程号
+        self.vv    = None
+        self.vh    = None
+        if vv is not None:
+            shape = (len(vv),) + _frame_shape(vv, vh)
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=2 * nbytes)
+            self.owner = os.getpid()
+            self._map(shape, dtype)
+            t, h, w = shape
+            for dst, src in ((self.vv, vv), (self.vh, vh)):
+                for i in range(t):
+                    dst[i] = src[i][:h, :w]
+
+    @classmethod
+    def attach(cls, name: str, shape: tuple, dtype: str = "float32") -> "SharedStack":
+        """attach to a block created by another process"""
+        stack = cls()
+        try:
+            stack.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 没有 track 参数：attach 时不向 resource_tracker 注册，
+            # 否则 worker 退出时会删除共享内存
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                stack.shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        stack._map(shape, dtype)
+        return stack
+
+    def _map(self, shape: tuple, dtype: str) -> None:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.vv = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.vh = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=nbytes)
+
+    def __reduce__(self):
+        return (SharedStack.attach, (self.shm.name, self.vv.shape, self.vv.dtype.name))
+
+    def close(self) -> None:
+        """detach, and free the memory if this process created it"""
+        self.vv = self.vh = None
+        self.shm.close()
+        if self.owner == os.getpid():
+            self.shm.unlink()
+
+
+def _frame_shape(vv, vh) -> tuple:
+    """common (H, W) of all frames of both polarizations"""
+    shapes = [f.shape for f in vv] + [f.shape for f in vh]
+    return (min(s[0] for s in shapes), min(s[1] for s in shapes))
+
+
+class PatchSampler:
+    """
+    Paired VV/VH (time, y, x) patches of a zone time series
+
+    Patches are cut from the sources on demand, nothing but the current
+    batches is held in memory.
+
+    Parameters
+    ----------
+        - vv, vh : (T, H, W) arrays (e.g. from `open_stack`), lists of 2-D
+                   arrays (e.g. from `open_data`) or a `SharedStack` as `vv`
+        - patch : (t, y, x) patch size, t=None for the whole time series
+        - mode : 'random' or 'grid'
+        - stride : (t, y, x) step of the grid, defaults to `patch`
+        - seed : random seed, the batch sequence is reproducible
+    """
+    def __init__(self, vv, vh=None, patch: tuple = (None, 64, 64), mode: str = "random",
+                 stride: tuple = None, seed: int = None) -> None:
+        if isinstance(vv, SharedStack):
+            vv, vh = vv.vv, vv.vh
+        if len(vv) != len(vh):
+            raise ValueError(f"VV has {len(vv)} acquisitions, VH has {len(vh)}")
+        if mode not in ("random", "grid"):
+            raise ValueError(f"unknown mode '{mode}', expected 'random' or 'grid'")
+        self.vv    = vv
+        self.vh    = vh
+        self.shape = (len(vv),) + _frame_shape(vv, vh)
+        self.patch = (patch[0] or self.shape[0],) + tuple(patch[1:])
+        self.mode  = mode
+        self.seed  = seed if seed is not None else np.random.SeedSequence().entropy
+        if any(p > s for p, s in zip(self.patch, self.shape)):
+            raise ValueError(f"patch {self.patch} is larger than the series {self.shape}")
+        stride = stride or self.patch
+        self.grid = [np.arange(0, s - p + 1, d)
+                     for s, p, d in zip(self.shape, self.patch, stride)]
+        self.patches = 0                 # 已生成的 patch 数
+        self.seconds = 0.0               # batches() 运行的时间
+        self._lock   = threading.Lock()
+
+    def __len__(self) -> int:
+        """number of grid positions"""
+        return int(np.prod([len(g) for g in self.grid]))
+
+    def origins(self, index: int, count: int) -> np.ndarray:
+        """
+        (t, y, x) origins of the patches of batch `index`
+
+        Random batches draw `count` origins from their own generator (seeded
+        by `seed` and `index`), grid batches take the next `count` grid
+        positions.
+        """
+        if self.mode == "random":
+            rng = np.random.default_rng([self.seed, index])
+            high = [s - p + 1 for s, p in zip(self.shape, self.patch)]
+            return rng.integers(0, high, size=(count, 3))
+        start = index * count
+        flat = np.arange(start, min(start + count, len(self)))
+        idx = np.unravel_index(flat, [len(g) for g in self.grid])
+        return np.stack([g[i] for g, i in zip(self.grid, idx)], axis=1)
+
+    def cut(self, origins: np.ndarray) -> np.ndarray:
+        """
+        Patches at `origins`
+
+        Return
+        ------
+            float32 array of shape (n, 2, t, y, x), channel 0 is VV, 1 is VH
+        """
+        pt, py, px = self.patch
+        batch = np.empty((len(origins), 2, pt, py, px), dtype=np.float32)
+        with stage("PatchSampler.cut", batch.nbytes):
+            for n, (t, y, x) in enumerate(origins):
+                for c, src in enumerate((self.vv, self.vh)):
+                    if isinstance(src, np.ndarray):
+                        batch[n, c] = src[t:t + pt, y:y + py, x:x + px]
+                    else:
+                        for i in range(pt):
+                            batch[n, c, i] = src[t + i][y:y + py, x:x + px]
+        with self._lock:
+            self.patches += len(origins)
+        return batch
+
+    def batch(self, index: int, batch_size: int) -> np.ndarray:
+        """batch `index` of `batch_size` patches, see `origins` and `cut`"""
+        return self.cut(self.origins(index, batch_size))
+
+    def batches(self, batch_size: int, n_batches: int = None, prefetch: int = 4,
+                threads: int = 2):
+        """
+        Iterate over batches prepared by background threads
+
+        Parameters
+        ----------
+            - batch_size : patches per batch (the last grid batch may be smaller)
+            - n_batches : number of batches, defaults to one pass over the
+                          grid, required for random mode
+            - prefetch : batches prepared ahead of the consumer
+            - threads : number of threads cutting patches
+
+        Yield
+        -----
+            float32 arrays of shape (n, 2, t, y, x)
+        """
+        if n_batches is None:
+            if self.mode == "random":
+                raise ValueError("n_batches is required in random mode")
+            n_batches = -(-len(self) // batch_size)
+        start = time.perf_counter()
+        pending = []
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                for index in range(n_batches):
+                    pending.append(pool.submit(self.batch, index, batch_size))
+                    if len(pending) > prefetch:
+                        yield pending.pop(0).result()
+                while pending:
+                    yield pending.pop(0).result()
+            finally:
+                for future in pending:
+                    future.cancel()
+                with self._lock:
+                    self.seconds += time.perf_counter() - start
+
+    def throughput(self) -> float:
+        """patches per second over the `batches()` runs so far"""
+        with self._lock:
+            return self.patches / self.seconds if self.seconds else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='patch sampler throughput test')
+    parser.add_argument('--stack', type=str, default=None, help="folder of the .npy stacks")
+    parser.add_argument('--zone', type=str, default=None, help="zone name of the stacks")
+    parser.add_argument('--size', type=int, default=None, help="size of the stacks")
+    parser.add_argument('--data', type=str, default=None,
+                        help="folder of *.data products, instead of --stack")
+    parser.add_argument('--shared', action='store_true',
+                        help="copy the sources into shared memory first")
+    parser.add_argument('--patch', type=int, nargs=3, default=[0, 64, 64],
+                        metavar=('T', 'Y', 'X'), help="patch size, T=0 for the whole series")
+    parser.add_argument('--mode', type=str, default="random", choices=("random", "grid"))
+    parser.add_argument('--batch', type=int, default=32, help="patches per batch")
+    parser.add_argument('--batches', type=int, default=100, help="number of batches")
+    parser.add_argument('--prefetch', type=int, default=4, help="batches prepared ahead")
+    parser.add_argument('--threads', type=int, default=2, help="threads cutting patches")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', action='store_true', help="print time/memory of each stage at exit")
+    args = parser.parse_args()
+    if args.profile:
+        enable()
+
+    if args.data:
+        vv, vh = open_data(args.data)
+    elif args.stack and args.zone and args.size:
+        vv, vh = open_stack(args.stack, args.zone, args.size)
+    else:
+        parser.error("--stack, --zone and --size, or --data is required")
+    shared = SharedStack(vv, vh) if args.shared else None
+    try:
+        sampler = PatchSampler(shared or vv, vh, args.patch, args.mode, seed=args.seed)
+        n_batches = args.batches if args.mode == "random" else None
+        for _ in sampler.batches(args.batch, n_batches, args.prefetch, args.threads):
+            pass
+        print(f"{sampler.patches} patches of {sampler.patch}, "
+              f"{sampler.throughput():.1f} patches/s")
+    finally:
+        if shared:
+            shared.close()
+
+
+if __name__ == "__main__":
+    main()
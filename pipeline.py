@@ -0,0 +1,268 @@
+### 流水线模式：下载、裁剪、叠加三个阶段同时进行。每下载完一个产品就立即裁剪（sentinel_crop 或 gpt），
+### 并把裁剪结果加入区域的时间序列中，同时继续下载其他产品。
+### 已下载但还未裁剪的产品数量受 max_raw 限制，避免磁盘被原始数据占满；
+### 设置 delete_raw=True 时，裁剪结果存入时间序列后删除原始 zip 文件（裁剪失败或被丢弃的产品保留）。
+
+import os
+import queue
+import threading
+import subprocess
+import numpy as np
+from PIL import Image
+from scipy.io import savemat
+from multiprocessing import Lock, Value
+from sentinelsat import SentinelAPI, read_geojson, geojson_to_wkt
+from bandreader import Band
+from sentinel_crop import crop
+from rangedownloader import RangeDownloader
+from ltascheduler import LTAScheduler
+from downloader_new import UserParameter, download_data, query_products, share_session
+
+
+class ZoneStack:
+    """
+    Time series of VV/VH slices of one zone
+
+    Every slice is saved as soon as it arrives (`<zonename>_slices/`), the
+    stacks are assembled in date order by `save()`.
+
+    Parameters
+    ----------
+        - save_path : folder of the stacks
+        - zonename : zone name, prefix of the stack files
+        - size : slices are cut to size x size
+    """
+    def __init__(self, save_path: str, zonename: str, size: int) -> None:
+        self.save_path = save_path
+        self.zonename  = zonename
+        self.size      = size
+        self.slice_dir = os.path.join(save_path, f"{zonename}_slices")
+        if not os.path.exists(self.slice_dir):
+            os.makedirs(self.slice_dir)
+
+    def append(self, name: str, data_vv: np.ndarray, data_vh: np.ndarray) -> bool:
+        """
+        Add the slices of one acquisition
+
+        Parameters
+        ----------
+            - name : sortable acquisition name, e.g. its date '20210106'
+            - data_vv, data_vh : cropped bands
+
+        Return
+        ------
+            False if the slices are dropped (too small or empty)
+        """
+        size = self.size
+        data_vv = data_vv[0:size, 0:size]
+        data_vh = data_vh[0:size, 0:size]
+        if data_vv.shape != (size, size) or data_vh.shape != (size, size):
+            print("WARN: the size of '{}' is not pair to ({}, {})".format(name, size, size))
+            return False
+        if data_vv.sum() < 100:  # 图像中没有像素信息时应该丢弃图片
+            return False
+        np.save(os.path.join(self.slice_dir, f"{name}_vv.npy"), data_vv.astype(np.float32))
+        np.save(os.path.join(self.slice_dir, f"{name}_vh.npy"), data_vh.astype(np.float32))
+        return True
+
+    def save(self) -> None:
+        """save `<zonename>_vv_/vh_<size>x<size>` stacks as `.npy` and `.mat`"""
+        names = sorted(f.removesuffix("_vv.npy") for f in os.listdir(self.slice_dir)
+                       if f.endswith("_vv.npy"))
+        spath = os.path.join(self.save_path, self.zonename)
+        size = self.size
+        for pol in ("vv", "vh"):
+            imgs = np.array([np.load(os.path.join(self.slice_dir, f"{n}_{pol}.npy"))
+                             for n in names], dtype=np.float32)
+            print(imgs.shape)
+            np.save(spath + f'_{pol}_{size}x{size}.npy', imgs)
+            imgs = imgs.swapaxes(1, 2).swapaxes(0, 2)
+            savemat(spath + f'_{pol}_{size}x{size}.mat', {'data': imgs})
+
+
+def gdal_cropper(geojson: str, dest: str):
+    """
+    Crop stage with `sentinel_crop` (gdalwarp)
+
+    Return
+    ------
+        callable(archive) -> (name, data_vv, data_vh)
+    """
+    def run(archive: str) -> tuple:
+        name = os.path.basename(archive).removesuffix(".zip")
+        tifs = crop(archive, geojson, dest, 1, os.path.join(dest, f"tmp_{name}"))
+        data_vv = data_vh = None
+        for tif in tifs:
+            if "-vv-" in os.path.basename(tif):
+                data_vv = np.array(Image.open(tif))
+            elif "-vh-" in os.path.basename(tif):
+                data_vh = np.array(Image.open(tif))
+        return name[17:32], data_vv, data_vh
+    return run
+
+
+def gpt_cropper(graph_path: str, dest: str, gpt: str = "gpt"):
+    """
+    Crop stage with a SNAP graph (e.g. `SangGenDaLai_Lake1.xml`)
+
+    Return
+    ------
+        callable(archive) -> (name, data_vv, data_vh)
+    """
+    def run(archive: str) -> tuple:
+        name = os.path.basename(archive).removesuffix(".zip")
+        output = os.path.join(dest, f"Subset_{name}.dim")
+        subprocess.call([gpt, graph_path, f"-Pinput={archive}", f"-Poutput={output}"])
+        data_path = output.removesuffix(".dim") + ".data"
+        if not os.path.exists(data_path):
+            return name[17:32], None, None
+        return (name[17:32], Band(data_path, "Intensity_VV").radar_pixels,
+                Band(data_path, "Intensity_VH").radar_pixels)
+    return run
+
+
+class Pipeline:
+    """
+    Download -> crop -> stack with overlapped stages
+
+    Download threads put finished products on a bounded queue, crop threads
+    take them off, crop them and append the result to the zone stack.
+
+    Parameters
+    ----------
+        - stack : ZoneStack
+        - cropper : callable(archive) -> (name, data_vv, data_vh), see
+                    `gdal_cropper` and `gpt_cropper`
+        - raw_path : folder of downloaded products
+        - max_raw : maximum products downloaded (or being downloaded) but
+                    not cropped yet
+        - crop_workers : number of crop threads
+        - delete_raw : delete the product zip once its subset is stored,
+                       products that fail to crop or are dropped are kept
+    """
+    def __init__(self, stack: ZoneStack, cropper, raw_path: str, max_raw: int = 4,
+                 crop_workers: int = 1, delete_raw: bool = False) -> None:
+        self.stack        = stack
+        self.cropper      = cropper
+        self.raw_path     = raw_path
+        self.delete_raw   = delete_raw
+        self.queue        = queue.Queue(maxsize=max_raw)
+        self.raw_slots    = threading.BoundedSemaphore(max_raw)
+        self.stored       = 0
+        self._lock        = threading.Lock()
+        self._workers     = [threading.Thread(target=self._crop_loop, daemon=True)
+                             for _ in range(crop_workers)]
+        for t in self._workers:
+            t.start()
+
+    def download_fn(self, api: SentinelAPI, titles: dict,
+                    engine: RangeDownloader = None):
+        """
+        Download stage, `download_data` followed by handing the product to
+        the crop stage; blocks while `max_raw` products wait for cropping
+
+        Parameters
+        ----------
+            - api : SentinelAPI
+            - titles : product ID -> product title
+            - engine : range-segment downloader for online products
+        """
+        def run(pid: str) -> int:
+            self.raw_slots.acquire()
+            res = download_data(api, pid, self.raw_path, engine)
+            if res != 0:
+                self.raw_slots.release()
+                return res
+            self.queue.put(os.path.join(self.raw_path, titles[pid] + ".zip"))
+            return 0
+        return run
+
+    def close(self) -> None:
+        """wait for the crop stage and save the stacks"""
+        self.queue.join()
+        for _ in self._workers:
+            self.queue.put(None)
+        for t in self._workers:
+            t.join()
+        print(f"{self.stored} acquisitions stacked")
+        self.stack.save()
+
+    def _crop_loop(self) -> None:
+        while True:
+            archive = self.queue.get()
+            if archive is None:
+                self.queue.task_done()
+                return
+            try:
+                name, data_vv, data_vh = self.cropper(archive)
+                if data_vv is not None and data_vh is not None \
+                        and self.stack.append(name, data_vv, data_vh):
+                    with self._lock:
+                        self.stored += 1
+                    # 只删除已经存入时间序列的产品, 其余的保留以便重新裁剪
+                    if self.delete_raw:
+                        os.remove(archive)
+            except Exception as e:
+                print(f"\033[1;33mWARN: failed to crop {os.path.basename(archive)}: {e}\033[0m")
+            finally:
+                self.raw_slots.release()
+                self.queue.task_done()
+
+
+def run_pipeline(params: UserParameter, pipeline: Pipeline) -> None:
+    """
+    Query, download, crop and stack all products
+
+    Parameters
+    ----------
+    `params`  : user parameters, `params.save_path` should be `pipeline.raw_path`
+    `pipeline` : Pipeline
+    """
+    if not os.path.exists(params.save_path):
+        os.makedirs(params.save_path)
+    api = SentinelAPI(params.user, params.password, params.api_url)
+    products = query_products(api, params)
+    titles = {pid: info['title'] for pid, info in products.items()}
+    engine = RangeDownloader(api.session, params.segments) if params.segments else None
+    scheduler = LTAScheduler(
+                    api,
+                    pipeline.download_fn(api, titles, engine),
+                    Lock(), Value('i', 0), Value('i', 0),
+                    workers=params.workers,
+                    quota=params.lta_quota,
+                    base_delay=params.lta_poll
+                )
+    share_session(api, params.workers * max(params.segments, 1) + 1)
+    scheduler.run(list(products.keys()))
+    pipeline.close()
+
+
+if __name__ == "__main__":
+    zonename     = "sanggendalaiStation"
+    geojson_path = "geojson/sanggendalaiStation3.geojson"
+    raw_path     = os.path.join("Products", zonename)
+    subset_path  = os.path.join("Subsets", zonename)
+    size         = 400
+
+    parameters = UserParameter(
+                        "your_username",
+                        "your_password",
+                        geojson_to_wkt(read_geojson(geojson_path)),
+                        ('20190101', '20201231'),
+                        'Sentinel-1',
+                        'GRD',
+                        'Ascending',
+                        save_path=raw_path,
+                        workers=2,
+                        segments=4
+                    )
+    pipeline = Pipeline(
+                    ZoneStack(os.path.join(subset_path, "matrix"), zonename, size),
+                    gdal_cropper(geojson_path, subset_path),
+                    # gpt_cropper("SangGenDaLai_Lake1.xml", subset_path),
+                    raw_path,
+                    max_raw=4,
+                    crop_workers=2,
+                    delete_raw=True
+                )
+    run_pipeline(parameters, pipeline)
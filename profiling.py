@@ -0,0 +1,131 @@
+### 各处理阶段的计时 / 内存统计。设置环境变量 SENTINEL_PROFILE=1 开启，命令行工具 (sentinel_crop、patchsampler) 也可以加上 --profile，
+### 程序结束时输出每个阶段的耗时、读写字节数和该阶段使进程峰值内存增加的量。未开启时 stage() / profiled 几乎没有开销。
+
+import os
+import sys
+import time
+import atexit
+import resource
+import functools
+
+
+_enabled = False
+_stats   = {}     # 阶段名 -> [调用次数, 耗时, 读字节数, 写字节数, 峰值内存的最大增量(KB)]
+
+
+class _Stage:
+    """timing context of one stage, see `stage()`"""
+    __slots__ = ("name", "bytes_read", "bytes_written", "_start", "_rss")
+
+    def __init__(self, name: str, bytes_read: int = 0, bytes_written: int = 0) -> None:
+        self.name          = name
+        self.bytes_read    = bytes_read
+        self.bytes_written = bytes_written
+
+    def __enter__(self):
+        self._rss = _maxrss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._start
+        # ru_maxrss 是整个进程生命周期的峰值, 只记录本阶段使它增加了多少
+        growth = _maxrss() - self._rss
+        s = _stats.setdefault(self.name, [0, 0.0, 0, 0, 0])
+        s[0] += 1
+        s[1] += wall
+        s[2] += self.bytes_read
+        s[3] += self.bytes_written
+        s[4] = max(s[4], growth)
+        return False
+
+
+def _maxrss() -> int:
+    """peak RSS (KB) of this process and its children so far"""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class _NoStage:
+    """shared do-nothing stage used while profiling is disabled"""
+    __slots__ = ()
+    bytes_read = bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def enable() -> None:
+    """turn profiling on and print the report when the program exits"""
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        atexit.register(report)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def stage(name: str, bytes_read: int = 0, bytes_written: int = 0):
+    """
+    Time a block of code
+
+        with stage("savemat") as st:
+            savemat(path, data)
+            st.bytes_written = os.path.getsize(path)
+
+    Parameters
+    ----------
+        - name : stage name in the report
+        - bytes_read, bytes_written : bytes moved by the stage, can also be
+                                      set on the returned object
+    """
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, bytes_read, bytes_written)
+
+
+def profiled(name: str = None):
+    """decorator version of `stage()`, the name defaults to the qualified function name"""
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report(file=None) -> None:
+    """
+    print the per-stage report: wall time, bytes read/written and the largest
+    increase of the process peak RSS during one call of the stage (0 when the
+    stage stayed below an earlier peak)
+    """
+    file = file or sys.stderr
+    if not _stats:
+        return
+    print(f"\n{'stage':<28}{'calls':>7}{'wall(s)':>10}{'read(MB)':>10}"
+          f"{'write(MB)':>11}{'peak RSS +(MB)':>16}", file=file)
+    for name, (calls, wall, nread, nwrite, rss) in sorted(
+            _stats.items(), key=lambda x: -x[1][1]):
+        print(f"{name:<28}{calls:>7}{wall:>10.3f}{nread / 1024 ** 2:>10.1f}"
+              f"{nwrite / 1024 ** 2:>11.1f}{rss / 1024:>16.1f}", file=file)
+
+
+if os.environ.get("SENTINEL_PROFILE", "") not in ("", "0"):
+    enable()
@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import threading
+import requests
+from sentinelsat.exceptions import InvalidChecksumError
+
+
+class StreamingMD5:
+    """
+    MD5 of a file that is written out of order
+
+    Bytes are hashed as soon as the contiguous prefix of the file grows:
+    chunks written right at the hashed offset are taken from memory, bytes
+    written ahead of it (by later segments) are read back once from the file.
+
+    Parameters
+    ----------
+        - fd : file descriptor of the file being written
+    """
+    def __init__(self, fd: int, chunk_size: int = 1 << 20) -> None:
+        self.fd         = fd
+        self.chunk_size = chunk_size
+        self.offset     = 0
+        self._md5       = hashlib.md5()
+        self._lock      = threading.Lock()
+
+    def update(self, offset: int, chunk: bytes, frontier: int) -> None:
+        """
+        Parameters
+        ----------
+            - offset : file offset where `chunk` has just been written
+            - chunk : the written bytes
+            - frontier : end of the contiguous written prefix of the file
+        """
+        with self._lock:
+            if offset == self.offset:
+                self._md5.update(chunk)
+                self.offset += len(chunk)
+            self._catch_up(frontier)
+
+    def hexdigest(self, frontier: int) -> str:
+        with self._lock:
+            self._catch_up(frontier)
+            return self._md5.hexdigest()
+
+    def _catch_up(self, frontier: int) -> None:
+        while self.offset < frontier:
+            buf = os.pread(self.fd, min(self.chunk_size, frontier - self.offset),
+                           self.offset)
+            if not buf:
+                break
+            self._md5.update(buf)
+            self.offset += len(buf)
+
+
+class RangeDownloader:
+    """
+    Download a file in parallel HTTP range segments
+
+    The data is written to `<path>.incomplete`, the progress of every segment
+    to `<path>.incomplete.json`. A failed or interrupted download is resumed
+    from the last written offset of each segment instead of from scratch.
+
+    Parameters
+    ----------
+        - session : requests.Session, e.g. `SentinelAPI.session` (keeps auth)
+        - segments : number of concurrent range requests
+        - chunk_size : bytes read from the response at a time
+        - max_times : maximum attempts of one segment
+        - timeout : timeout of one request (seconds)
+    """
+    def __init__(self, session: requests.Session = None, segments: int = 4,
+                 chunk_size: int = 1 << 20, max_times: int = 3,
+                 timeout: float = 60) -> None:
+        self.session    = session or requests.Session()
+        self.segments   = segments
+        self.chunk_size = chunk_size
+        self.max_times  = max_times
+        self.timeout    = timeout
+
+    def download(self, url: str, path: str, size: int = None,
+                 md5: str = None) -> int:
+        """
+        Download `url` to `path`
+
+        Parameters
+        ----------
+            - url : file url
+            - path : save path
+            - size : file size in bytes, asked from the server if None
+            - md5 : expected checksum, checked on the streamed bytes
+
+        Return
+        ------
+            bytes received by this call, 0 if `path` already exists; bytes
+            downloaded by an earlier, interrupted call are not counted
+        """
+        if os.path.exists(path):
+            return 0
+        tmp_path = path + ".incomplete"
+        state_path = tmp_path + ".json"
+        ranges = True
+        if size is None:
+            size, ranges = self._probe(url)
+
+        state = None
+        if ranges and os.path.exists(tmp_path) and os.path.exists(state_path):
+            with open(state_path, 'r') as fr:
+                state = json.load(fr)
+            if state["size"] != size:
+                state = None
+        if state is None:
+            # 服务器不支持 range 请求时只能整体下载
+            state = {"size": size,
+                     "segments": self._split(size, self.segments if ranges else 1)}
+            with open(tmp_path, 'wb') as fw:
+                fw.truncate(size)
+            self._save_state(state_path, state)
+
+        fd = os.open(tmp_path, os.O_RDWR)
+        try:
+            hasher = StreamingMD5(fd, self.chunk_size)
+            lock = threading.Lock()
+            received = [0]
+            threads = [threading.Thread(target=self._fetch,
+                                        args=(url, fd, seg, ranges, state,
+                                              state_path, hasher, lock, received))
+                       for seg in state["segments"] if seg[2] <= seg[1]]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            frontier = self._frontier(state)
+            if frontier < size:
+                if not ranges:
+                    os.remove(state_path)
+                raise requests.ConnectionError(
+                    f"{os.path.basename(path)}: {frontier}/{size} bytes downloaded")
+            if md5 and hasher.hexdigest(frontier).lower() != md5.lower():
+                os.remove(tmp_path)
+                os.remove(state_path)
+                raise InvalidChecksumError(
+                    f"File corrupt: checksums do not match for {os.path.basename(path)}")
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+        os.remove(state_path)
+        return received[0]
+
+    def _probe(self, url: str) -> tuple:
+        """(file size, whether the server accepts range requests)"""
+        with self.session.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                              timeout=self.timeout) as r:
+            r.raise_for_status()
+            if r.status_code == 206:
+                return int(r.headers["Content-Range"].split("/")[-1]), True
+            return int(r.headers["Content-Length"]), False
+
+    def _split(self, size: int, n: int) -> list:
+        """[[start, end, next offset to download], ...], `end` included"""
+        n = max(1, min(n, size // self.chunk_size))
+        step = size // n
+        bounds = [i * step for i in range(n)] + [size]
+        return [[bounds[i], bounds[i + 1] - 1, bounds[i]] for i in range(n)]
+
+    @staticmethod
+    def _frontier(state: dict) -> int:
+        """end of the contiguous downloaded prefix"""
+        frontier = 0
+        for start, end, offset in state["segments"]:
+            frontier = offset
+            if offset <= end:
+                break
+        return frontier
+
+    @staticmethod
+    def _save_state(state_path: str, state: dict) -> None:
+        with open(state_path + ".tmp", 'w') as fw:
+            json.dump(state, fw)
+        os.replace(state_path + ".tmp", state_path)
+
+    def _fetch(self, url: str, fd: int, seg: list, ranges: bool, state: dict,
+               state_path: str, hasher: StreamingMD5, lock: threading.Lock,
+               received: list) -> None:
+        # 不支持 range 请求时无法续传, 失败后由下一次 download() 从头开始
+        for _ in range(self.max_times if ranges else 1):
+            headers = {"Range": f"bytes={seg[2]}-{seg[1]}"} if ranges else {}
+            try:
+                with self.session.get(url, headers=headers, stream=True,
+                                      timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    if ranges and r.status_code != 206:
+                        raise requests.HTTPError("server ignored the range request")
+                    for chunk in r.iter_content(self.chunk_size):
+                        offset = seg[2]
+                        os.pwrite(fd, chunk, offset)
+                        with lock:
+                            received[0] += len(chunk)
+                            seg[2] = offset + len(chunk)
+                            self._save_state(state_path, state)
+                            frontier = self._frontier(state)
+                        hasher.update(offset, chunk, frontier)
+                if seg[2] > seg[1]:
+                    return
+            except requests.RequestException as e:
+                print(f"\033[1;33mWARN: segment {seg[0]}-{seg[1]} failed at "
+                      f"{seg[2]}: {e}\033[0m")
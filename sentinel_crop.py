@@ -28,74 +28,115 @@ from zipfile import ZipFile
 import shutil
 import os
 import subprocess
+from profiling import stage, enable
 
-def sentinel1_process(args, zf, mini, maxi):
+def sentinel1_process(dest, zf, mini, maxi, tmp_dir="tmp"):
 
     print("searching for jp2 files")
+    outfiles = []
     filelist = zf.namelist()
     for fname in filelist:
         if("measurement" in fname and ".tiff" in fname):
             print(fname)
             root_fname = fname.split("/")[-1].split(".")[0]
-            infile = os.path.join("tmp",fname)
-            outfile = os.path.join(args.dest, root_fname+".tif")
+            infile = os.path.join(tmp_dir,fname)
+            outfile = os.path.join(dest, root_fname+".tif")
             cmd = ['/usr/bin/gdalwarp', "-t_srs", "EPSG:4326", "-te", str(mini[0]), str(mini[1]), str(maxi[0]), str(maxi[1]), infile, outfile]
-            subprocess.call(cmd)
+            with stage("gdalwarp", os.path.getsize(infile)) as st:
+                subprocess.call(cmd)
+                if os.path.exists(outfile):
+                    st.bytes_written = os.path.getsize(outfile)
+            outfiles.append(outfile)
+    return outfiles
 
     # pass
 
-def sentinel2_process(args, zf, mini, maxi):
+def sentinel2_process(dest, zf, mini, maxi, tmp_dir="tmp"):
 
     print("searching for jp2 files")
+    outfiles = []
     filelist = zf.namelist()
     for fname in filelist:
         if("GRANULE" in fname and "IMG_DATA" in fname and ".jp2" in fname):
             print(fname)
             root_fname = fname.split("/")[-1].split(".")[0]
-            infile = os.path.join("tmp",fname)
-            outfile = os.path.join(args.dest, root_fname+".tif")
+            infile = os.path.join(tmp_dir,fname)
+            outfile = os.path.join(dest, root_fname+".tif")
             # cmd = ['gdalwarp', "-t_srs", "EPSG:4326", "-te", str(mini[0]), str(mini[1]), str(maxi[0]), str(maxi[1]), "-ts", "1024", "1024", infile, outfile]
             cmd = ['/usr/bin/gdalwarp', "-t_srs", "EPSG:4326", "-te", str(mini[0]), str(mini[1]), str(maxi[0]), str(maxi[1]), infile, outfile]
-            subprocess.call(cmd)
-
-
-def main():
-    parser = argparse.ArgumentParser(description='PyTorch sentinel crop')
-    parser.add_argument('--sentinel', type=int, default=1, metavar='N',
-                        help='1 for sentinel1 and 2 for sentinel 2')
-    parser.add_argument('--archive', type=str, default="archive", metavar='N',
-                        help='archive of sentinel')
-    parser.add_argument('--geojson', type=str, default="map.geojson", metavar='N', help="footprint")
-    parser.add_argument('--dest', type=str, default="crop_results", metavar='N', help="distination folder")
-    args = parser.parse_args()
-
-
+            with stage("gdalwarp", os.path.getsize(infile)) as st:
+                subprocess.call(cmd)
+                if os.path.exists(outfile):
+                    st.bytes_written = os.path.getsize(outfile)
+            outfiles.append(outfile)
+    return outfiles
+
+
+def crop(archive, geojson, dest, sentinel=1, tmp_dir="tmp"):
+    """
+    Crop a Sentinel product (zip) to the bounding box of a geojson footprint
+
+    Parameters
+    ----------
+        - archive : product zip
+        - geojson : footprint
+        - dest : destination folder
+        - sentinel : 1 for sentinel1 and 2 for sentinel 2
+        - tmp_dir : temp directory, must differ between concurrent calls
+
+    Returns
+    -------
+        list of cropped `.tif` files
+    """
     print("loading footprint...")
-    footprint = json.load(open(args.geojson))
+    footprint = json.load(open(geojson))
     coordinates = np.array(footprint["features"][0]["geometry"]["coordinates"][0])
     mini = coordinates.min(axis=0)
     maxi = coordinates.max(axis=0)
 
     print("removing temp directory and creating destination...")
-    if os.path.exists("tmp"):
-        shutil.rmtree("tmp")
-    if not os.path.exists(args.dest):
-        os.makedirs(args.dest)
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    if not os.path.exists(dest):
+        os.makedirs(dest)
 
     print("extracting the dataset to temp directory...")
-    zf = ZipFile(args.archive, 'r')
-    zf.extractall("tmp")
+    zf = ZipFile(archive, 'r')
+    # 只解压需要裁剪的影像文件
+    members = [f for f in zf.namelist() if ("measurement" in f and ".tiff" in f)
+               or ("GRANULE" in f and "IMG_DATA" in f and ".jp2" in f)]
+    with stage("unzip", sum(zf.getinfo(m).compress_size for m in members)):
+        zf.extractall(tmp_dir, members)
 
     print("Entering image function...")
-    if args.sentinel == 1:
+    outfiles = []
+    if sentinel == 1:
         print("SENITNEL1")
-        sentinel1_process(args, zf, mini, maxi)
-    elif args.sentinel == 2:
+        outfiles = sentinel1_process(dest, zf, mini, maxi, tmp_dir)
+    elif sentinel == 2:
         print("SENTINEL2")
-        sentinel2_process(args, zf, mini, maxi)
+        outfiles = sentinel2_process(dest, zf, mini, maxi, tmp_dir)
+    zf.close()
 
     print("removing tmp files")
-    shutil.rmtree("tmp")
+    shutil.rmtree(tmp_dir)
+    return outfiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyTorch sentinel crop')
+    parser.add_argument('--sentinel', type=int, default=1, metavar='N',
+                        help='1 for sentinel1 and 2 for sentinel 2')
+    parser.add_argument('--archive', type=str, default="archive", metavar='N',
+                        help='archive of sentinel')
+    parser.add_argument('--geojson', type=str, default="map.geojson", metavar='N', help="footprint")
+    parser.add_argument('--dest', type=str, default="crop_results", metavar='N', help="distination folder")
+    parser.add_argument('--profile', action='store_true', help="print time/memory of each stage at exit")
+    args = parser.parse_args()
+    if args.profile:
+        enable()
+
+    crop(args.archive, args.geojson, args.dest, args.sentinel)
 
 if __name__ == "__main__":
     main()